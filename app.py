@@ -1,44 +1,167 @@
 import eventlet
 eventlet.monkey_patch()
 
+import atexit
 import random
+import resource
 import string
+import sys
 import time
-from flask import Flask, render_template, request, Response
+from flask import Flask, render_template, request, Response, jsonify, stream_with_context
 from flask_socketio import SocketIO, emit, join_room, leave_room
-from flask_sqlalchemy import SQLAlchemy 
-import csv 
-from io import StringIO 
 import os
+import functools
+import operator
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from eventlet.queue import LightQueue, Empty, Full
+from room_store import make_room_store
+from cluster import make_cluster
+from game_state import Room, RoundState, PlayLog, PlayRecord
+from cooperative_db import setup_cooperative_db, engine_options, run_db
+from play_journal import PlayJournal
+from migrations import migrate
+from export_formats import EXPORT_FORMATS
+from metrics import Counter, Gauge, Histogram, render as render_metrics, timed, timed_iter
+from models import (db, RoundPlay, GameSession, SessionCompletion, play_rows, store_plays,
+                    mark_sessions_complete, parse_observer_input)
+from structured_log import setup_logging
+from hub_monitor import HubMonitor
+import profiler
 
 app = Flask(__name__)
+# Leveled JSON lines, written by a background thread (see structured_log.py)
+log = setup_logging('app')
 app.config['SECRET_KEY'] = 'your-secret-key-for-testing!'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
 
-socketio = SocketIO(app)
-db = SQLAlchemy(app)
+# With more than one worker, emits have to go through a shared queue
+# (e.g. redis://) to reach sockets connected to the other workers.
+socketio = SocketIO(app, message_queue=os.environ.get('SOCKETIO_MESSAGE_QUEUE'))
+# Database calls yield to the hub instead of blocking it (see cooperative_db.py)
+db_mode = setup_cooperative_db(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(db_mode)
+db.init_app(app)
 
-class Play(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
+# Live rooms and the sid -> room index. In-process by default; set
+# ROOM_STORE_URL to share them between workers (see room_store.py).
+room_store = make_room_store(os.environ.get('ROOM_STORE_URL'))
 
-    game_session_id = db.Column(db.String(50), nullable=False, index=True)
-    
-    round_number = db.Column(db.Integer, nullable=False)
-    set_number = db.Column(db.Integer, nullable=False)
-    
-    play_number_in_round = db.Column(db.Integer, nullable=False)
-    player_sid = db.Column(db.String(100))
-    value_played = db.Column(db.Integer, nullable=False)
-    time_since_previous = db.Column(db.Float, nullable=False)
-    was_mistake = db.Column(db.Boolean, nullable=False)
-    
-    observer_input = db.Column(db.String(100))
+# Optional room affinity: each room code belongs to one worker and events
+# for it are forwarded there (see cluster.py). None when running alone.
+cluster = make_cluster(os.environ.get('WORKER_ID'),
+                       os.environ.get('CLUSTER_WORKERS'),
+                       os.environ.get('CLUSTER_SECRET', ''))
+# Our own sockets that are playing in rooms owned by another worker
+remote_sids = {}
+# Unwrapped room event handlers, for running events forwarded to us
+room_event_handlers = {}
+
+# Buffered plays are flushed at every round boundary (or once a room has
+# this many) and wait here until the persistence worker commits them, so
+# event handlers never block on the database.
+PLAY_FLUSH_THRESHOLD = int(os.environ.get('PLAY_FLUSH_THRESHOLD', 30))
+PERSIST_QUEUE_SIZE = int(os.environ.get('PERSIST_QUEUE_SIZE', 1000))
+# PERSIST_BATCH_GAMES is the older name of the same setting
+PERSIST_BATCH_SIZE = int(os.environ.get('PERSIST_BATCH_SIZE',
+                                        os.environ.get('PERSIST_BATCH_GAMES', 50)))
+PERSIST_MAX_RETRIES = 5
+PERSIST_RETRY_DELAY = 0.5
+
+persist_queue = LightQueue(PERSIST_QUEUE_SIZE)
+persist_worker = None
+persist_stats = {
+    'queue_depth': 0,
+    'queued_flushes': 0,
+    'committed_flushes': 0,
+    'committed_plays': 0,
+    'failed_flushes': 0,
+    'retries': 0,
+    'commits': 0,
+    'last_commit_seconds': 0.0,
+    'total_commit_seconds': 0.0,
+    # Plays sitting in room buffers on this worker, not yet flushed
+    'buffered_plays': 0,
+}
+
+# Optional crash-safe copy of every buffered play (see play_journal.py)
+PLAY_JOURNAL_DIR = os.environ.get('PLAY_JOURNAL_DIR')
+JOURNAL_FSYNC_INTERVAL = float(os.environ.get('JOURNAL_FSYNC_INTERVAL', 0.05))
+JOURNAL_SEGMENT_BYTES = int(os.environ.get('JOURNAL_SEGMENT_BYTES', 4 * 1024 * 1024))
+# How often to look for journaled plays another worker has saved
+JOURNAL_RECONCILE_INTERVAL = float(os.environ.get('JOURNAL_RECONCILE_INTERVAL', 30))
+
+journal = PlayJournal(PLAY_JOURNAL_DIR, JOURNAL_SEGMENT_BYTES) if PLAY_JOURNAL_DIR else None
+journal_syncer = None
+
+# Rooms that sit idle in one state for longer than its TTL (seconds) get
+# evicted by the reaper, so abandoned games can't pile up forever.
+ROOM_TTLS = {
+    'lobby': int(os.environ.get('ROOM_TTL_LOBBY', 30 * 60)),
+    'running': int(os.environ.get('ROOM_TTL_RUNNING', 60 * 60)),
+    'waiting_for_input': int(os.environ.get('ROOM_TTL_WAITING_FOR_INPUT', 60 * 60)),
+}
+REAPER_INTERVAL = int(os.environ.get('REAPER_INTERVAL', 60))
+
+# Last activity per room, one OrderedDict per state with the oldest first.
+# Each state has a single TTL, so a sweep only looks at expired rooms.
+room_activity = {state: OrderedDict() for state in ROOM_TTLS}
+room_activity_state = {}
+reaper = None
+reaper_stats = {
+    'sweeps': 0,
+    'evicted_lobby': 0,
+    'evicted_running': 0,
+    'evicted_waiting_for_input': 0,
+    'last_sweep_seconds': 0.0,
+}
+
+# Exposed on /metrics (see metrics.py)
+HANDLER_SECONDS = Histogram('socketio_handler_seconds',
+                            'Time spent handling each Socket.IO event', ('event',))
+HANDLER_ERRORS = Counter('socketio_handler_errors_total',
+                         'Socket.IO handlers that raised', ('event',))
+COMMIT_SECONDS = Histogram('play_commit_seconds', 'Time to commit one batch of plays')
+EXPORT_SECONDS = Histogram('export_seconds', 'Time to stream one export', ('format',))
+HUB_LAG_SECONDS = Histogram('hub_lag_seconds', 'How late the hub monitor woke up')
+SLOW_HANDLERS = Counter('slow_handlers_total',
+                        'Handlers still running after SLOW_HANDLER_SECONDS', ('event',))
 
-    def __repr__(self):
-        return f'<Play {self.id} (Room: {self.game_session_id} Round: {self.round_number})>'
+# Hub stalls and slow handlers (see hub_monitor.py)
+hub_monitor = HubMonitor(log, HUB_LAG_SECONDS.labels(), SLOW_HANDLERS,
+                         interval=float(os.environ.get('HUB_MONITOR_INTERVAL', 0.02)),
+                         slow_threshold=float(os.environ.get('SLOW_HANDLER_SECONDS', 0.1)))
 
-game_rooms = {}
+def resident_memory_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # No /proc: fall back to the peak, which macOS reports in bytes
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+def observed(event):
+    timer = timed(HANDLER_SECONDS.labels(event), HANDLER_ERRORS.labels(event))
+    return lambda handler: timer(hub_monitor.watched(event, handler))
+
+Gauge('rooms_live', 'Rooms in the room store', lambda: len(room_store))
+Gauge('rooms_by_status', 'Rooms on this worker by game status',
+      lambda: {(state,): len(rooms) for state, rooms in room_activity.items()}, ('status',))
+Gauge('connected_sids', 'Sockets connected to this worker',
+      lambda: len(socketio.server.manager.rooms.get('/', {}).get(None, {})))
+Gauge('hub_lag_last_seconds', 'Hub lag at the latest monitor wake-up',
+      lambda: hub_monitor.last_lag)
+Gauge('process_resident_memory_bytes', 'Resident memory of this worker',
+      resident_memory_bytes)
+Gauge('log_records_dropped', 'Log records dropped because the log queue was full',
+      lambda: sum(getattr(handler, 'dropped', 0) for handler in log.handlers))
+for stats, prefix in ((persist_stats, 'persist'), (reaper_stats, 'reaper')):
+    for key in stats:
+        Gauge(f'{prefix}_{key}', f'{prefix}_stats[{key!r}]',
+              functools.partial(stats.get, key))
 
 @app.route('/')
 def index():
@@ -48,121 +171,251 @@ def generate_room_code(length=4):
     return "".join(random.choices(string.ascii_uppercase, k=length))
     
 def get_room_code_for_sid(sid):
-    for room_code, data in game_rooms.items():
-        if sid in data['players']:
-            return room_code
-    return None
+    return room_store.room_for_sid(sid) or remote_sids.get(sid)
+
+def sid_room_code(*args):
+    return get_room_code_for_sid(request.sid)
+
+def room_event(room_code_of=sid_room_code, forget_sid=False):
+    # Runs the handler here when this worker owns the room, otherwise
+    # forwards the event to the worker that does.
+    def decorator(handler):
+        room_event_handlers[handler.__name__] = handler
+
+        @functools.wraps(handler)
+        def wrapper(*args):
+            room_code = room_code_of(*args) if cluster else None
+            if not room_code or cluster.owns(room_code):
+                return handler(*args)
+
+            sid = request.sid
+            owner = cluster.owner(room_code)
+            remote_sids[sid] = room_code
+            try:
+                cluster.forward(owner, handler.__name__, sid, args)
+            except OSError as e:
+                log.error("Could not forward %s to worker %s: %s", handler.__name__, owner, e,
+                          extra={'event': 'forward_failed', 'room': room_code, 'sid': sid})
+            if forget_sid:
+                remote_sids.pop(sid, None)
+        return wrapper
+    return decorator
+
+@contextmanager
+def locked_room(room_code):
+    # Loads the room under its store lock and writes it back when the
+    # handler is done, so workers sharing a store don't lose updates.
+    with room_store.lock(room_code):
+        room = room_store.get(room_code)
+        yield room
+        if room is not None and not room.closed:
+            touch_room(room_code, room)
+            room_store.put(room_code, room)
+
+def close_room(room_code, room):
+    # Keep whatever an abandoned game played; it stays marked incomplete
+    if room.state and room.state.buffer:
+        flush_plays(room.state)
+    room.closed = True
+    room_store.delete(room_code)
+    forget_room(room_code)
+    for player_sid in room.players:
+        room_store.unbind_sid(player_sid, room_code)
+    # Codes get reused, so the old sockets mustn't hear the next game
+    socketio.close_room(room_code)
+
+def room_state(room):
+    if not room.state:
+        return 'lobby'
+    if room.state.status == 'waiting_for_input':
+        return 'waiting_for_input'
+    return 'running'
+
+def touch_room(room_code, room, last_active=None):
+    global reaper
+    if reaper is None:
+        reaper = socketio.start_background_task(reaper_loop)
+
+    if last_active is None:
+        last_active = time.time()
+        room.last_active = last_active
+    forget_room(room_code)
+    state = room_state(room)
+    room_activity[state][room_code] = last_active
+    room_activity_state[room_code] = state
+
+def forget_room(room_code):
+    state = room_activity_state.pop(room_code, None)
+    if state is not None:
+        room_activity[state].pop(room_code, None)
+
+def reaper_loop():
+    while True:
+        socketio.sleep(REAPER_INTERVAL)
+        start = time.time()
+        try:
+            evicted = reap_idle_rooms(start)
+        except Exception:
+            # Keep reaping on the next sweep. The room that failed is no
+            # longer tracked; its next event tracks it again.
+            log.exception("Reaper sweep failed", extra={'event': 'reaper_error'})
+            continue
+        reaper_stats['sweeps'] += 1
+        reaper_stats['last_sweep_seconds'] = time.time() - start
+        if evicted:
+            log.info("Reaper evicted %d idle rooms", evicted,
+                     extra={'event': 'reaper_sweep', 'evicted': evicted})
+
+def reap_idle_rooms(now):
+    evicted = 0
+    for state, ttl in ROOM_TTLS.items():
+        tracked = room_activity[state]
+        while tracked:
+            room_code, last_active = next(iter(tracked.items()))
+            if now - last_active < ttl:
+                break
+            forget_room(room_code)
+            if evict_room(room_code, now):
+                evicted += 1
+    return evicted
+
+def evict_room(room_code, now):
+    with room_store.lock(room_code):
+        room = room_store.get(room_code)
+        if room is None:
+            return False
+
+        # With a shared store another worker may have used the room since
+        # we last saw it, so go by the activity time stored in the room.
+        state = room_state(room)
+        if now - room.last_active < ROOM_TTLS[state]:
+            touch_room(room_code, room, last_active=room.last_active)
+            return False
+
+        for player_sid in room.players:
+            socketio.emit('room_expired', to=player_sid)
+        close_room(room_code, room)
+
+    reaper_stats['evicted_' + state] += 1
+    log.info("Room evicted after sitting idle in %s", state,
+             extra={'event': 'room_evicted', 'room': room_code, 'status': state})
+    return True
 
 @socketio.on('connect')
-def handle_connect():
-    print(f"Client connected: {request.sid}")
+@observed('connect')
+def handle_connect(auth=None):
+    log.info("Client connected", extra={'event': 'connect', 'sid': request.sid})
 
 @socketio.on('disconnect')
-def handle_disconnect():
-    print(f"Client disconnected: {request.sid}")
+@observed('disconnect')
+@room_event(forget_sid=True)
+def handle_disconnect(reason=None):
+    log.info("Client disconnected", extra={'event': 'disconnect', 'sid': request.sid})
     room_code = get_room_code_for_sid(request.sid)
-    
-    if room_code in game_rooms:
-        room = game_rooms[room_code]
+    if not room_code:
+        return
+
+    with locked_room(room_code) as room:
+        if not room:
+            return
         
         leave_room(room_code)
         # Tell the *other* player their opponent left
-        for player_sid in room['players']:
+        for player_sid in room.players:
             if player_sid != request.sid:
                 emit('opponent_disconnected', room=player_sid)
-            if player_sid == request.sid:
-                room['players'].remove(player_sid)
+        if request.sid in room.players:
+            room.players.remove(request.sid)
+        room_store.unbind_sid(request.sid, room_code)
         
-        if len(room['players']) == 0:
-            game_rooms.pop(room_code, None)
-            print(f"Room {room_code} cleaned up due to disconnect.")
+        if len(room.players) == 0:
+            close_room(room_code, room)
+            log.info("Room cleaned up due to disconnect",
+                     extra={'event': 'room_closed', 'room': room_code})
 
 
 @socketio.on('create_room')
+@observed('create_room')
 def handle_create_room():
+    room = Room(request.sid, time.time())
     room_code = generate_room_code()
-    while room_code in game_rooms:
+    # Only hand out codes this worker owns, so new rooms are always local
+    while (cluster and not cluster.owns(room_code)) or not room_store.add(room_code, room):
         room_code = generate_room_code()
-        
-    game_rooms[room_code] = {
-        'players': [request.sid],
-        'game_state': {}
-    }
+    room_store.bind_sid(request.sid, room_code)
+    touch_room(room_code, room, last_active=room.last_active)
     join_room(room_code)
-    print(f"Room {room_code} created. Player 1: {request.sid}")
+    log.info("Room created", extra={'event': 'room_created', 'room': room_code, 'sid': request.sid})
     emit('room_created', {'room_code': room_code})
 
 @socketio.on('join_room')
+@observed('join_room')
+@room_event(room_code_of=lambda data: data.get('room_code'))
 def handle_join_room(data):
     room_code = data.get('room_code')
-    if not room_code in game_rooms:
-        emit('error_message', {'message': 'Room not found.'})
-        return
-    room = game_rooms[room_code]
-    if len(room['players']) >= 2:
-        emit('error_message', {'message': 'This room is full.'})
-        return
-    if request.sid in room['players']:
-        return
-    room['players'].append(request.sid)
-    join_room(room_code)
-    print(f"Player 2 {request.sid} joined room {room_code}.")
-    emit('game_ready', room=room_code)
+    with locked_room(room_code) as room:
+        if not room:
+            emit('error_message', {'message': 'Room not found.'})
+            return
+        if len(room.players) >= 2:
+            emit('error_message', {'message': 'This room is full.'})
+            return
+        if request.sid in room.players:
+            return
+        room.players.append(request.sid)
+        room_store.bind_sid(request.sid, room_code)
+        join_room(room_code)
+        log.info("Player 2 joined", extra={'event': 'player_joined', 'room': room_code, 'sid': request.sid})
+        emit('game_ready', room=room_code)
 
 @socketio.on('start_round')
+@observed('start_round')
+@room_event()
 def handle_start_round():
     room_code = get_room_code_for_sid(request.sid)
-    room = game_rooms[room_code]
-    if not room or len(room['players']) != 2: return
+    if not room_code: return
+    with locked_room(room_code) as room:
+        if not room or len(room.players) != 2: return
         
-    if not room['game_state']:
-        room['game_state'] = {
-        'game_data_buffer': [],
-        'round_number': 1, # Will be set to 1 by the helper
-        'set_number': 0,
-        'mistake_count': 0,
-        'game_status': 'pending',
-        'play_start_time': None,
-        'all_played_list': [],
-        'hands': {},
-        'pending_inputs': {}
-        }
-        start_new_round(room_code, round_num = room["game_state"]["round_number"])
+        if not room.state:
+            room.state = RoundState(f"{room_code}-{uuid.uuid4().hex[:8]}")
+            start_new_round(room_code, room, round_num = room.state.round_number)
     
-    #If a player reconnects halfway through a round, just reset the round
-    if len(room['game_state']['all_played_list']) != 10:
-        start_new_round(room_code, round_num = room["game_state"]["round_number"])
-    else: #Start new round
-        start_new_round(room_code, round_num = room["game_state"]["round_number"] + 1)
-
-def start_new_round(room_code, round_num):
-    room = game_rooms.get(room_code)
-        
-    state = room['game_state']
+        #If a player reconnects halfway through a round, just reset the round
+        if len(room.state.plays) != 10:
+            start_new_round(room_code, room, round_num = room.state.round_number)
+        else: #Start new round
+            start_new_round(room_code, room, round_num = room.state.round_number + 1)
+
+def start_new_round(room_code, room, round_num):
+    state = room.state
 
     set_num = 2 if round_num > 3 else 1
-    player1_sid = room['players'][0]
-    player2_sid = room['players'][1]
+    player1_sid = room.players[0]
+    player2_sid = room.players[1]
     
     all_numbers = random.sample(range(1, 101), 10)
     hand1 = sorted(all_numbers[:5])
     hand2 = sorted(all_numbers[5:])
 
-    state['round_number'] = round_num
-    state['set_number'] = set_num
-    state['mistake_count'] = 0
-    state['game_status'] = 'running'
-    state['play_start_time'] = time.time()
-    state['all_played_list'] = []
-    state['hands'] = {
+    state.round_number = round_num
+    state.set_number = set_num
+    state.mistake_count = 0
+    state.status = 'running'
+    state.play_start_time = time.time()
+    state.plays = PlayLog()
+    state.hands = {
         player1_sid: hand1,
         player2_sid: hand2
     }
-    state['pending_inputs'] = {}
+    state.board_sent = 0
+    room.seq += 1
     
-    print(f"Starting round {round_num} (Set {set_num}) in room {room_code}.")
+    log.info("Starting round %d (set %d)", round_num, set_num,
+             extra={'event': 'round_started', 'room': room_code, 'round': round_num, 'set': set_num})
 
     emit('game_started', {
+        'seq': room.seq,
         'hand': hand1,
         'board': [],
         'round': round_num,
@@ -170,6 +423,7 @@ def start_new_round(room_code, round_num):
     }, room=player1_sid)
     
     emit('game_started', {
+        'seq': room.seq,
         'hand': hand2,
         'board': [],
         'round': round_num,
@@ -177,6 +431,8 @@ def start_new_round(room_code, round_num):
     }, room=player2_sid)
 
 @socketio.on('play_number')
+@observed('play_number')
+@room_event()
 def handle_play_number(data):
     value = data.get('value') 
     actor_sid = request.sid
@@ -184,267 +440,733 @@ def handle_play_number(data):
     if not room_code:
         return
     
-    room = game_rooms[room_code]   
-    all_players = room['players']
-    observer_sid = all_players[0] if all_players[1] == actor_sid else all_players[1]
+    with locked_room(room_code) as room:
+        if not room or len(room.players) != 2 or not room.state:
+            return
+        all_players = room.players
+        observer_sid = all_players[0] if all_players[1] == actor_sid else all_players[1]
 
-    state = room['game_state']
-    if state['game_status'] != 'running': 
-        return
+        state = room.state
+        if state.status != 'running': 
+            return
     
-    actor_hand = state['hands'][actor_sid]
-    observer_hand = state['hands'][observer_sid]
-    if not actor_hand or value not in actor_hand: 
-        return
+        actor_hand = state.hands[actor_sid]
+        observer_hand = state.hands[observer_sid]
+        if not actor_hand or value not in actor_hand: 
+            return
 
-    current_time = time.time()
-    play_time = current_time - state['play_start_time']
+        current_time = time.time()
+        play_time = current_time - state.play_start_time
 
-    all_remaining_numbers = state['hands'][all_players[0]] + state['hands'][all_players[1]]
-    true_min = min(all_remaining_numbers)
+        all_remaining_numbers = state.hands[all_players[0]] + state.hands[all_players[1]]
+        true_min = min(all_remaining_numbers)
     
-    was_mistake = False
-    if value != true_min:
-        was_mistake = True
-        state['mistake_count'] += 1
-
-        for card in observer_hand.copy():
-            if card < value:
-                play_obvious_card(card, observer_sid)
+        was_mistake = False
+        cascade_played = False
+        if value != true_min:
+            was_mistake = True
+            state.mistake_count += 1
+
+            # Cascade plays are applied silently and sent as one update below
+            for card in observer_hand.copy():
+                if card < value:
+                    play_obvious_card(room_code, room, card, observer_sid)
+                    cascade_played = True
         
-        for card in actor_hand.copy():
-            if card < value:
-                play_obvious_card(card, actor_sid)
-
-    play_data = {
-        'value': value,
-        'isMistake': was_mistake,
-        'player_sid': actor_sid,
-        'time_played': play_time
-    }
-    state['all_played_list'].append(play_data)
-    actor_hand.remove(value)
+            for card in actor_hand.copy():
+                if card < value:
+                    play_obvious_card(room_code, room, card, actor_sid)
+                    cascade_played = True
 
-    if len(actor_hand) == 0:
-        for card in observer_hand.copy():
-            play_obvious_card(card, observer_sid)
-    if len(observer_hand) == 0:
-        for card in actor_hand.copy():
-            play_obvious_card(card, actor_sid)
+        state.pending_play = len(state.plays)
+        state.plays.append(value, was_mistake, all_players.index(actor_sid), play_time)
+        actor_hand.remove(value)
 
-    state['game_status'] = 'waiting_for_input'
+        if len(actor_hand) == 0:
+            for card in observer_hand.copy():
+                play_obvious_card(room_code, room, card, observer_sid)
+                cascade_played = True
+        if len(observer_hand) == 0:
+            for card in actor_hand.copy():
+                play_obvious_card(room_code, room, card, actor_sid)
+                cascade_played = True
 
-    state['temp_play_data'] = play_data
-    state['observer_sid'] = observer_sid
-    state['actor_sid'] = actor_sid
+        if cascade_played:
+            emit_game_state(room, start_counter=False)
+
+        state.status = 'waiting_for_input'
+
+        state.observer_sid = observer_sid
+        state.actor_sid = actor_sid
     
-    print(f"Player {actor_sid} played {value}. Waiting for input from {observer_sid}.")
+        log.debug("Card %s played, waiting for input", value,
+                  extra={'event': 'card_played', 'room': room_code, 'round': state.round_number,
+                         'sid': actor_sid, 'observer': observer_sid})
 
-    emit('wait_for_input', room=actor_sid)
+        emit('wait_for_input', room=actor_sid)
 
-    emit('request_input', {'set': state['set_number']}, room=observer_sid)
+        emit('request_input', {'set': state.set_number}, room=observer_sid)
 
-    if was_mistake:
-        emit('mistake_notice', {
-            'value': value,
-            'correct_value': true_min
-        }, room=room_code)
+        if was_mistake:
+            emit('mistake_notice', {
+                'value': value,
+                'correct_value': true_min
+            }, room=room_code)
 
-def play_obvious_card(value, player_sid):
-    room_code = get_room_code_for_sid(player_sid)
-    room = game_rooms[room_code]
-    state = room['game_state']  
+def play_obvious_card(room_code, room, value, player_sid):
+    state = room.state
 
-    play_data = {
-        'value': value,
-        'isMistake': False,
-        'player_sid': player_sid,
-        'time_played': 0
-    }
-    state['all_played_list'].append(play_data)
-    state['hands'][player_sid].remove(value)
-
-    new_play = Play(
-        game_session_id=room_code,
-        round_number=state['round_number'],
-        set_number=state['set_number'],
-        play_number_in_round=len(state['all_played_list']),
+    state.plays.append(value, False, room.players.index(player_sid), 0)
+    state.hands[player_sid].remove(value)
+
+    new_play = PlayRecord(
+        game_session_id=state.session_id,
+        round_number=state.round_number,
+        set_number=state.set_number,
+        play_number_in_round=len(state.plays),
         player_sid=player_sid,
         value_played=value,
         time_since_previous=0,
         was_mistake=False,
-        observer_input=None
+        observer_input=None,
+        time_played_at=time.time(),
+        hub_lag=hub_monitor.current_lag()
     )
-    state['game_data_buffer'].append(new_play)
+    buffer_play(state, new_play)
 
-    for player in room['players']:
+def emit_game_state(room, start_counter):
+    # Sends only the plays appended since the last broadcast; each player
+    # drops their own played cards from their hand.
+    state = room.state
+    sent = state.board_sent
+    state.board_sent = len(state.plays)
+    room.seq += 1
+
+    board_delta = state.plays.public(sent)
+    for player, player_sid in enumerate(room.players):
         emit('game_state_update', {
-            'hand': state['hands'][player],
-            'board': state['all_played_list'],
-            'start_counter': False
-        }, room=player)
+            'seq': room.seq,
+            'plays': board_delta,
+            'removed': state.plays.played_by(player, sent),
+            'start_counter': start_counter
+        }, room=player_sid)
+
+@socketio.on('request_snapshot')
+@observed('request_snapshot')
+@room_event()
+def handle_request_snapshot():
+    sid = request.sid
+    room_code = get_room_code_for_sid(sid)
+    if not room_code:
+        return
+
+    room = room_store.get(room_code)
+    if not room or not room.state or sid not in room.state.hands:
+        return
+    state = room.state
+
+    # Rebuild the state as of the last broadcast seq, so the deltas that
+    # follow still apply cleanly on top of this snapshot.
+    unsent = state.plays.played_by(room.players.index(sid), state.board_sent)
+    hand = state.hands[sid] + unsent
+
+    emit('game_state_snapshot', {
+        'seq': room.seq,
+        'hand': sorted(hand),
+        'board': state.plays.public(0, state.board_sent),
+        'round': state.round_number,
+        'set': state.set_number
+    })
 
 @socketio.on('submit_input')
+@observed('submit_input')
+@room_event()
 def handle_submit_input(data):
     observer_sid = request.sid
     input_data = data.get('input_data')
     room_code = get_room_code_for_sid(observer_sid)
     
     if not room_code: return
-    room = game_rooms[room_code]
-    state = room['game_state']
+    with locked_room(room_code) as room:
+        if not room or not room.state: return
+        state = room.state
     
-    if state['game_status'] != 'waiting_for_input' or state['observer_sid'] != observer_sid:
-        print(f"Warning: Player {observer_sid} submitted input at an invalid time.")
-        return
+        if state.status != 'waiting_for_input' or state.observer_sid != observer_sid:
+            log.warning("Input submitted at an invalid time",
+                        extra={'event': 'input_out_of_turn', 'room': room_code, 'sid': observer_sid})
+            return
     
-    play_data = state.pop('temp_play_data', {})
-    actor_sid = state.pop('actor_sid', None)
-
-    new_play = Play(
-        game_session_id=room_code,
-        round_number=state['round_number'],
-        set_number=state['set_number'],
-        play_number_in_round=len(state['all_played_list']),
-        player_sid=actor_sid,
-        value_played=play_data.get('value'),
-        time_since_previous=play_data.get('time_played'),
-        was_mistake=play_data.get('isMistake'),
-        observer_input=input_data
-    )
+        played = state.pending_play
+        actor_sid = state.actor_sid
+        state.pending_play = None
+        state.actor_sid = None
+
+        observer_input, observer_input_raw = parse_observer_input(state.set_number, input_data)
+        played_at = state.play_start_time + state.plays.times[played]
+        if observer_input_raw is not None:
+            log.warning("Invalid observer input %r for set %d", observer_input_raw, state.set_number,
+                        extra={'event': 'invalid_input', 'room': room_code,
+                               'round': state.round_number, 'sid': observer_sid})
+
+        new_play = PlayRecord(
+            game_session_id=state.session_id,
+            round_number=state.round_number,
+            set_number=state.set_number,
+            play_number_in_round=played + 1,
+            player_sid=actor_sid,
+            value_played=state.plays.values[played],
+            time_since_previous=state.plays.times[played],
+            was_mistake=bool(state.plays.mistakes[played]),
+            observer_input=observer_input,
+            time_played_at=played_at,
+            observer_input_raw=observer_input_raw,
+            hub_lag=hub_monitor.max_lag_between(state.play_start_time, played_at)
+        )
     
-    state['game_data_buffer'].append(new_play)
+        buffer_play(state, new_play)
     
-    print(f"--- Data Buffered (Play {len(state['game_data_buffer'])}/100) ---")
-    print(f"  Room: {room_code}, Round: {state['round_number']}")
-    print(f"---------------------------------")
+        log.debug("Play %d/10 buffered", len(state.plays),
+                  extra={'event': 'play_buffered', 'room': room_code,
+                         'round': state.round_number, 'sid': actor_sid})
     
-    state['game_status'] = 'running'
-    state['play_start_time'] = time.time()
-
-    if len(state['all_played_list']) >= 10:
-        print(f"Round {state['round_number']} over for room {room_code}.")
-
-        for player_sid in room['players']:
-            emit('game_state_update', {
-                'hand': state['hands'][player_sid],
-                'board': state['all_played_list'],
-                'start_counter': False
-            }, room=player_sid)
-        
-        if state['round_number'] >= 6:
-            print(f"GAME OVER for room {room_code}. Committing data.")
-            
-            try:
-                all_plays_to_save = state['game_data_buffer']
+        state.status = 'running'
+        state.play_start_time = time.time()
 
-                db.session.add_all(all_plays_to_save)
+        if len(state.plays) >= 10:
+            log.info("Round over", extra={'event': 'round_over', 'room': room_code,
+                                          'round': state.round_number})
 
-                db.session.commit()
-                print(f"--- BATCH DATABASE SAVE SUCCESS ({len(all_plays_to_save)} plays) ---")
-            
-            except Exception as e:
-                db.session.rollback()
-                print(f"!!! BATCH DATABASE SAVE FAILED: {e} !!!")
+            flush_plays(state, game_complete=state.round_number >= 6)
+            emit_game_state(room, start_counter=False)
+        
+            if state.round_number >= 6:
+                log.info("Game over, data queued for save",
+                         extra={'event': 'game_over', 'room': room_code, 'round': state.round_number,
+                                'mistakes': state.mistake_count})
 
-            emit('game_over', {
-                'round': state['round_number'],
-                'mistakes': state['mistake_count']
-            }, room=room_code)
+                emit('game_over', {
+                    'round': state.round_number,
+                    'mistakes': state.mistake_count
+                }, room=room_code)
 
-            game_rooms.pop(room_code, None)
+                close_room(room_code, room)
 
-        else:
-            # (This is the Round Over block)
-            emit('round_over', {
-                'round': state['round_number'],
-                'mistakes': state['mistake_count']
-            }, room=room_code)
+            else:
+                # (This is the Round Over block)
+                emit('round_over', {
+                    'round': state.round_number,
+                    'mistakes': state.mistake_count
+                }, room=room_code)
     
-    else:
-        for player_sid in room['players']:
-            emit('game_state_update', {
-                'hand': state['hands'][player_sid],
-                'board': state['all_played_list'],
-                'start_counter': True
-            }, room=player_sid)
+        else:
+            if len(state.buffer) >= PLAY_FLUSH_THRESHOLD:
+                flush_plays(state)
+            emit_game_state(room, start_counter=True)
 @socketio.on('reset_round')
+@observed('reset_round')
+@room_event()
 def handle_reset_round():
     sid = request.sid
     room_code = get_room_code_for_sid(sid)
     
     if not room_code:
-        print(f"Error: Player {sid} not in a room.")
+        log.warning("Player not in a room", extra={'event': 'reset_round', 'sid': sid})
         return
         
-    room = game_rooms[room_code]
-    state = room['game_state']
+    with locked_room(room_code) as room:
+        if not room or len(room.players) != 2 or not room.state:
+            return
+        state = room.state
     
-    current_round_num = state['round_number']
-    current_set_num = state['set_number']
+        current_round_num = state.round_number
+        current_set_num = state.set_number
     
-    print(f"RESETTING round {current_round_num} in room {room_code}.")
+        log.info("Resetting round", extra={'event': 'reset_round', 'room': room_code,
+                                            'round': current_round_num})
     
-    player1_sid = room['players'][0]
-    player2_sid = room['players'][1]
+        player1_sid = room.players[0]
+        player2_sid = room.players[1]
     
-    all_numbers = random.sample(range(0, 101), 10)
-    hand1 = sorted(all_numbers[:5])
-    hand2 = sorted(all_numbers[5:])
+        all_numbers = random.sample(range(0, 101), 10)
+        hand1 = sorted(all_numbers[:5])
+        hand2 = sorted(all_numbers[5:])
 
-    state['mistake_count'] = 0
-    state['game_status'] = 'running'
-    state['play_start_time'] = time.time()
-    state['all_played_list'] = []
-    state['hands'] = {
-        player1_sid: hand1,
-        player2_sid: hand2
-    }
-    state['pending_inputs'] = {}
+        state.mistake_count = 0
+        state.status = 'running'
+        state.play_start_time = time.time()
+        state.plays = PlayLog()
+        state.hands = {
+            player1_sid: hand1,
+            player2_sid: hand2
+        }
+        state.board_sent = 0
+        room.seq += 1
     
-    emit('game_started', {
-        'hand': hand1,
-        'board': [],
-        'round': current_round_num,
-        'set': current_set_num
-    }, room=player1_sid)
+        emit('game_started', {
+            'seq': room.seq,
+            'hand': hand1,
+            'board': [],
+            'round': current_round_num,
+            'set': current_set_num
+        }, room=player1_sid)
     
-    emit('game_started', {
-        'hand': hand2,
-        'board': [],
-        'round': current_round_num,
-        'set': current_set_num
-    }, room=player2_sid)
+        emit('game_started', {
+            'seq': room.seq,
+            'hand': hand2,
+            'board': [],
+            'round': current_round_num,
+            'set': current_set_num
+        }, room=player2_sid)
+
+@app.route('/internal/room-event', methods=['POST'])
+def handle_forwarded_event():
+    if not cluster or not cluster.authorized(request.headers.get('X-Cluster-Secret')):
+        return "Not authorized", 403
+
+    message = request.get_json()
+    handler = room_event_handlers.get(message['event'])
+    if handler is None:
+        return "Unknown event", 400
+
+    # Run the handler as if the socket had sent the event to us; emits and
+    # room joins reach the other worker through the message queue.
+    request.sid = message['sid']
+    request.namespace = '/'
+    handler(*message['args'])
+    return "", 204
+
+def buffer_play(state, record):
+    global journal_syncer
+    if journal:
+        if journal_syncer is None:
+            journal_syncer = socketio.start_background_task(journal_sync_loop)
+        journal.append_play(record)
+    state.buffer.append(record)
+    persist_stats['buffered_plays'] += 1
+
+def journal_sync_loop():
+    last_reconcile = time.time()
+    while True:
+        socketio.sleep(JOURNAL_FSYNC_INTERVAL)
+        try:
+            journal.sync()
+        except Exception as e:
+            log.error("Play journal fsync failed: %s", e, extra={'event': 'journal_sync_failed'})
+        if time.time() - last_reconcile >= JOURNAL_RECONCILE_INTERVAL:
+            last_reconcile = time.time()
+            try:
+                reconcile_journal()
+            except Exception as e:
+                log.error("Play journal reconcile failed: %s", e,
+                          extra={'event': 'journal_reconcile_failed'})
+
+def reconcile_journal():
+    # With a shared room store the worker that ends a round saves it, which
+    # may not be the one that journaled its plays
+    keys = journal.rotated_pending()
+    if keys:
+        saved = run_db(db_mode, fetch_saved_journal_entries, keys)
+        journal.settle(saved)
+
+def fetch_saved_journal_entries(keys):
+    # A play counts as saved when its row holds this version or a newer one
+    # (a reset round reuses play numbers); a game once it is marked complete
+    sessions = sorted({key.game_session_id if isinstance(key, PlayRecord) else key[1]
+                       for key in keys})
+    saved_at, complete = {}, set()
+    with app.app_context():
+        for i in range(0, len(sessions), 1000):
+            rows = db.session.execute(
+                db.select(play_rows.c.game_session_id, play_rows.c.round_number,
+                          play_rows.c.play_number_in_round, play_rows.c.time_played_at,
+                          play_rows.c.game_complete)
+                .where(play_rows.c.game_session_id.in_(sessions[i:i + 1000])))
+            for session_id, round_number, play_number, played_at, game_complete in rows:
+                saved_at[(session_id, round_number, play_number)] = played_at
+                if game_complete:
+                    complete.add(session_id)
+    saved = []
+    for key in keys:
+        if not isinstance(key, PlayRecord):
+            if key[1] in complete:
+                saved.append(key)
+            continue
+        played_at = saved_at.get((key.game_session_id, key.round_number, key.play_number_in_round))
+        if played_at is not None and (key.time_played_at is None or played_at >= key.time_played_at):
+            saved.append(key)
+    return saved
+
+def flush_plays(state, game_complete=False):
+    if journal and game_complete:
+        journal.append_complete(state.session_id)
+    queue_plays_for_save(state.session_id, state.buffer, game_complete)
+    persist_stats['buffered_plays'] -= len(state.buffer)
+    state.buffer = []
+
+def queue_plays_for_save(session_id, records, game_complete):
+    global persist_worker
+    if persist_worker is None:
+        persist_worker = socketio.start_background_task(persist_worker_loop)
+
+    flush = (session_id, records, game_complete)
+    try:
+        persist_queue.put_nowait(flush)
+    except Full:
+        # Queue is backed up, save this one inline rather than drop it
+        log.warning("Persist queue full, saving session inline",
+                    extra={'event': 'persist_queue_full', 'session': session_id})
+        commit_play_batch([flush])
+        return
+    persist_stats['queued_flushes'] += 1
+    persist_stats['queue_depth'] = persist_queue.qsize()
+
+def persist_worker_loop():
+    while True:
+        batch = [persist_queue.get()]
+        while len(batch) < PERSIST_BATCH_SIZE:
+            try:
+                batch.append(persist_queue.get_nowait())
+            except Empty:
+                break
+        persist_stats['queue_depth'] = persist_queue.qsize()
+        try:
+            commit_play_batch(batch)
+        except Exception:
+            # Keep the worker alive for the next batch. With a journal
+            # these plays are still on disk and replayed on restart.
+            persist_stats['failed_flushes'] += len(batch)
+            log.exception("Persist worker failed on a batch",
+                          extra={'event': 'persist_worker_error', 'flushes': len(batch)})
+
+def save_play_records(records, complete_sessions):
+    with app.app_context():
+        try:
+            conn = db.session.connection()
+            store_plays(conn, records)
+            if complete_sessions:
+                mark_sessions_complete(conn, complete_sessions)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+def commit_play_batch(batch):
+    records = [record for _, flush_records, _ in batch for record in flush_records]
+    complete_sessions = [session_id for session_id, _, game_complete in batch if game_complete]
+    delay = PERSIST_RETRY_DELAY
+
+    for attempt in range(PERSIST_MAX_RETRIES):
+        start = time.time()
+        try:
+            run_db(db_mode, save_play_records, records, complete_sessions)
+        except Exception as e:
+            log.warning("Batch database save failed: %s", e,
+                        extra={'event': 'batch_save_failed', 'attempt': attempt + 1,
+                               'flushes': len(batch)})
+            if len(batch) > 1:
+                # One bad flush shouldn't cost the other rooms their plays,
+                # so save each flush on its own, with its own retries
+                return all([commit_play_batch([flush]) for flush in batch])
+        else:
+            elapsed = time.time() - start
+            persist_stats['commits'] += 1
+            persist_stats['committed_flushes'] += len(batch)
+            persist_stats['committed_plays'] += len(records)
+            persist_stats['last_commit_seconds'] = elapsed
+            persist_stats['total_commit_seconds'] += elapsed
+            COMMIT_SECONDS.labels().observe(elapsed)
+            log.info("Batch saved", extra={'event': 'batch_saved', 'flushes': len(batch),
+                                           'plays': len(records), 'seconds': elapsed})
+            if journal:
+                for session_id, flush_records, game_complete in batch:
+                    journal.committed(flush_records, session_id if game_complete else None)
+            return True
+        if attempt + 1 < PERSIST_MAX_RETRIES:
+            persist_stats['retries'] += 1
+            eventlet.sleep(delay)
+            delay *= 2
+
+    persist_stats['failed_flushes'] += len(batch)
+    log.error("Giving up on saving sessions %s", sorted({session_id for session_id, _, _ in batch}),
+              extra={'event': 'batch_abandoned'})
+    return False
+
+@atexit.register
+def flush_persist_queue():
+    batch = []
+    while True:
+        try:
+            batch.append(persist_queue.get_nowait())
+        except Empty:
+            break
+    persist_stats['queue_depth'] = 0
+    if batch:
+        log.info("Flushing %d queued play batches before shutdown", len(batch),
+                 extra={'event': 'shutdown_flush'})
+        commit_play_batch(batch)
+    if journal:
+        journal.close()
+
+if journal and journal.leftover:
+    # Plays a previous run journaled but may never have committed
+    log.info("Replaying %d play journal segments from %s", len(journal.leftover), journal.directory,
+             extra={'event': 'journal_replay'})
+    replayed = journal.replay(commit_play_batch)
+    log.info("Replayed %d journaled plays", replayed, extra={'event': 'journal_replay'})
+
+EXPORT_COLUMNS = [
+    'id', 'game_session_id', 'round_number', 'set_number', 
+    'play_number_in_round', 'player_sid', 'value_played', 
+    'time_since_previous', 'was_mistake', 'observer_input', 'game_complete',
+    'time_played_at', 'observer_input_raw', 'hub_lag'
+]
+# game_complete is only current in full exports, see export_data
+INCREMENTAL_EXPORT_COLUMNS = [name for name in EXPORT_COLUMNS if name != 'game_complete']
+EXPORT_PAGE_SIZE = 5000
+ADMIN_KEY = 'none-shall-pass-unless-their-names-starts-with-an-I'
+
+def export_conditions(last_id, max_id, since_time):
+    conditions = [play_rows.c.id > last_id, play_rows.c.id <= max_id]
+    if since_time is not None:
+        # Ids follow save order, not play order (a retried or replayed flush
+        # is saved late), so filter on the time itself, which is indexed
+        conditions.append(play_rows.c.time_played_at > since_time)
+    return conditions
+
+def fetch_play_page(last_id, max_id, page_size, since_time=None, names=EXPORT_COLUMNS):
+    columns = [play_rows.c[name] for name in names]
+    with app.app_context():
+        return db.session.execute(
+            db.select(*columns)
+            .where(*export_conditions(last_id, max_id, since_time))
+            .order_by(play_rows.c.id)
+            .limit(page_size)
+        ).all()
+
+def fetch_max_play_id():
+    # Read off the end of the primary key index, not the table
+    with app.app_context():
+        return db.session.execute(db.select(db.func.max(RoundPlay.id))).scalar() or 0
+
+def fetch_max_completion_id():
+    with app.app_context():
+        return db.session.execute(db.select(db.func.max(SessionCompletion.id))).scalar() or 0
+
+def stream_play_rows(last_id, max_id, since_time=None, page_size=EXPORT_PAGE_SIZE,
+                     names=EXPORT_COLUMNS):
+    # psycopg2 only: one query read through a named server-side cursor,
+    # page_size rows per fetchmany. Each fetch is an ordinary round trip,
+    # so it yields to the hub through the wait callback like any query.
+    columns = [play_rows.c[name] for name in names]
+    with db.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=page_size).execute(
+            db.select(*columns)
+            .where(*export_conditions(last_id, max_id, since_time))
+            .order_by(play_rows.c.id))
+        yield from result.partitions()
+
+def iter_play_rows(last_id=0, max_id=None, page_size=EXPORT_PAGE_SIZE, since_time=None,
+                   names=EXPORT_COLUMNS):
+    # Keyset pagination on id: each page is an index range scan and we only
+    # ever hold one page of plain row tuples in memory.
+    if max_id is None:
+        max_id = run_db(db_mode, fetch_max_play_id)
+    while True:
+        rows = run_db(db_mode, fetch_play_page, last_id, max_id, page_size, since_time, names)
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
 
 @app.route('/admin/export/<secret_key>')
 def export_data(secret_key):
-    if secret_key != 'none-shall-pass-unless-their-names-starts-with-an-I':
+    if secret_key != ADMIN_KEY:
         return "Not authorized", 403
 
-    si = StringIO()
-    cw = csv.writer(si)
- 
-    plays = Play.query.order_by(Play.id).all()
-    
-    header = [
-        'id', 'game_session_id', 'round_number', 'set_number', 
-        'play_number_in_round', 'player_sid', 'value_played', 
-        'time_since_previous', 'was_mistake', 'observer_input'
-    ]
-    cw.writerow(header)
-    
-    for play in plays:
-        cw.writerow([
-            play.id, play.game_session_id, play.round_number, 
-            play.set_number, play.play_number_in_round, play.player_sid,
-            play.value_played, play.time_since_previous, play.was_mistake,
-            play.observer_input
-        ])
-    
-    output = si.getvalue()
-    return Response(
-        output,
-        mimetype="text/csv",
-        headers={"Content-disposition":
-                 "attachment; filename=game_export.csv"})
+    # Incremental pulls: pass the X-Next-Cursor of the previous export as
+    # since_id, or a unix time as since_time, to get only newer plays.
+    # A replayed or re-saved play comes back with a new id, so consumers
+    # should key rows on (game_session_id, round_number, play_number_in_round).
+    # A game is marked complete after its early rounds were saved, without
+    # touching their ids, so incremental pulls leave game_complete out.
+    # Follow completions from X-Completion-Cursor on /admin/completions.
+    since_id = request.args.get('since_id', 0, type=int)
+    since_time = request.args.get('since_time', type=float)
+    incremental = since_id > 0 or since_time is not None
+    names = INCREMENTAL_EXPORT_COLUMNS if incremental else EXPORT_COLUMNS
+
+    # ?format= wins, otherwise go by the Accept header; CSV by default
+    export_format = request.args.get('format') or request.accept_mimetypes.best_match(
+        [mimetype for mimetype, _, _, _ in EXPORT_FORMATS.values()], 'text/csv')
+    export_format = next((name for name, (mimetype, _, _, _) in EXPORT_FORMATS.items()
+                          if export_format in (name, mimetype)), export_format)
+    if export_format not in EXPORT_FORMATS:
+        return f"Unknown export format {export_format!r}", 400
+    mimetype, extension, writer, available = EXPORT_FORMATS[export_format]
+    if not available:
+        return f"The {export_format} export isn't available on this server", 501
+
+    # Plays are only ever added with higher ids, so the newest id tags
+    # the whole table. Rows saved after this point wait for the next pull.
+    # Read the completion cursor first: a game completing meanwhile shows
+    # up on /admin/completions even if this export already sees it.
+    completion_id = run_db(db_mode, fetch_max_completion_id)
+    max_id = run_db(db_mode, fetch_max_play_id)
+    etag = f"plays-{max_id}-{completion_id}-{export_format}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        if db_mode == 'wait_callback':
+            pages = stream_play_rows(since_id, max_id, since_time, names=names)
+        else:
+            pages = iter_play_rows(since_id, max_id, since_time=since_time, names=names)
+        types = [play_rows.c[name].type.python_type for name in names]
+        chunks = writer(names, types, pages)
+        response = Response(
+            stream_with_context(timed_iter(chunks, EXPORT_SECONDS.labels(export_format))),
+            mimetype=mimetype,
+            headers={"Content-disposition":
+                     f"attachment; filename=game_export.{extension}"})
+    response.set_etag(etag)
+    response.headers["X-Next-Cursor"] = str(max_id)
+    response.headers["X-Completion-Cursor"] = str(completion_id)
+    response.vary.add("Accept")
+    return response
+
+QUERY_PAGE_SIZE = 100
+QUERY_MAX_PAGE_SIZE = 1000
+
+def parse_bool(value):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+# query parameter: (column, comparison, parser)
+QUERY_FILTERS = {
+    'game_session_id': ('game_session_id', operator.eq, str),
+    'set_number': ('set_number', operator.eq, int),
+    'round_number': ('round_number', operator.eq, int),
+    'was_mistake': ('was_mistake', operator.eq, parse_bool),
+    'after_id': ('id', operator.gt, int),
+    'max_id': ('id', operator.le, int),
+    'from_time': ('time_played_at', operator.ge, float),
+    'to_time': ('time_played_at', operator.lt, float),
+    # Leave out plays whose timing a stalled hub may have inflated
+    'max_hub_lag': ('hub_lag', operator.le, float),
+}
+
+def fetch_plays(conditions, limit):
+    columns = [play_rows.c[name] for name in EXPORT_COLUMNS]
+    with app.app_context():
+        return db.session.execute(
+            db.select(*columns)
+            .where(*conditions)
+            .order_by(play_rows.c.id)
+            .limit(limit)
+        ).all()
+
+@app.route('/admin/plays/<secret_key>')
+def query_plays(secret_key):
+    # Filtered, paged reads for analysts. Pages are keyset on id: pass the
+    # returned next_cursor back as after_id until it comes back null.
+    if secret_key != ADMIN_KEY:
+        return "Not authorized", 403
+
+    conditions = []
+    try:
+        for param, (name, comparison, parse) in QUERY_FILTERS.items():
+            if param in request.args:
+                conditions.append(comparison(play_rows.c[name], parse(request.args[param])))
+        limit = int(request.args.get('limit', QUERY_PAGE_SIZE))
+    except ValueError as e:
+        return jsonify({'error': f"Bad query parameter: {e}"}), 400
+    limit = max(1, min(limit, QUERY_MAX_PAGE_SIZE))
+
+    # One extra row tells us whether there is another page
+    rows = run_db(db_mode, fetch_plays, conditions, limit + 1)
+    return jsonify({
+        'plays': [dict(zip(EXPORT_COLUMNS, row)) for row in rows[:limit]],
+        'next_cursor': rows[limit - 1][0] if len(rows) > limit else None,
+    })
+
+COMPLETIONS_PAGE_SIZE = 1000
+
+def fetch_completions(after_id, limit):
+    with app.app_context():
+        return db.session.execute(
+            db.select(SessionCompletion.id, GameSession.session_key)
+            .join(GameSession, SessionCompletion.session_id == GameSession.id)
+            .where(SessionCompletion.id > after_id)
+            .order_by(SessionCompletion.id)
+            .limit(limit)
+        ).all()
+
+@app.route('/admin/completions/<secret_key>')
+def query_completions(secret_key):
+    # Games completed after ?after_id=, in the order they completed. Start
+    # from an export's X-Completion-Cursor and page like /admin/plays.
+    if secret_key != ADMIN_KEY:
+        return "Not authorized", 403
+    try:
+        after_id = int(request.args.get('after_id', 0))
+    except ValueError as e:
+        return jsonify({'error': f"Bad query parameter: {e}"}), 400
+
+    rows = run_db(db_mode, fetch_completions, after_id, COMPLETIONS_PAGE_SIZE + 1)
+    return jsonify({
+        'completions': [{'id': completion_id, 'game_session_id': session_key}
+                        for completion_id, session_key in rows[:COMPLETIONS_PAGE_SIZE]],
+        'next_cursor': rows[COMPLETIONS_PAGE_SIZE - 1][0] if len(rows) > COMPLETIONS_PAGE_SIZE else None,
+    })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+def profile_args(default_seconds):
+    seconds = float(request.args.get('seconds', default_seconds))
+    return max(0.1, min(seconds, profiler.MAX_SECONDS))
+
+@app.route('/admin/profile/<secret_key>')
+def profile_endpoint(secret_key):
+    # Sampling profile of this worker for ?seconds=, as collapsed stacks
+    # for flamegraph.pl or speedscope
+    if secret_key != ADMIN_KEY:
+        return "Not authorized", 403
+    try:
+        seconds = profile_args(10)
+        interval = max(0.001, float(request.args.get('interval', 0.005)))
+    except ValueError as e:
+        return jsonify({'error': f"Bad query parameter: {e}"}), 400
+
+    waiting = lambda: [(event, current) for current, (event, _) in list(hub_monitor.active.items())]
+    try:
+        stacks = profiler.profile_stacks(seconds, interval, waiting)
+    except profiler.ProfilerBusy:
+        return jsonify({'error': "A profile is already running"}), 409
+    return Response(stacks, mimetype='text/plain', headers={
+        "Content-disposition": f"attachment; filename=profile-{int(time.time())}.folded"})
+
+@app.route('/admin/memory/<secret_key>')
+def memory_endpoint(secret_key):
+    # Top allocating lines over ?seconds=, traced only for the duration
+    if secret_key != ADMIN_KEY:
+        return "Not authorized", 403
+    try:
+        seconds = profile_args(10)
+        top = max(1, min(int(request.args.get('top', 25)), 200))
+    except ValueError as e:
+        return jsonify({'error': f"Bad query parameter: {e}"}), 400
+
+    try:
+        return jsonify(profiler.trace_allocations(seconds, top))
+    except profiler.ProfilerBusy:
+        return jsonify({'error': "A profile is already running"}), 409
 
+@app.cli.command('migrate-db')
+def migrate_db_command():
+    """Bring the database schema up to date (see migrations.py)."""
+    applied = migrate(db.engine)
+    print(f"Applied migrations {applied}." if applied else "Schema already up to date.")
@@ -0,0 +1,71 @@
+"""Messages sent for a mistake cascade, on worst-case deals.
+
+Deals fixed hands and has one player play a card that forces every lower
+card out as a cascade, then the observer answers. Counts the Socket.IO
+messages (and their JSON size) both players receive for that play and
+answer. Before cascades were coalesced a cascade of n cards cost 2n
+game_state_update messages plus the usual ones; now it should be one
+update per player whatever n is.
+
+    python bench/cascade_messages.py
+"""
+import json
+import os
+import sys
+import tempfile
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + tempfile.mktemp(suffix='.db'))
+os.environ.setdefault('LOG_LEVEL', 'error')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app as appmod  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+# name: (host hand, guest hand, cards played in order by (player, value))
+DEALS = {
+    'no mistake': ([2, 4, 6, 8, 10], [1, 3, 5, 7, 9], [('guest', 1)]),
+    'cascade of 9': ([10, 20, 30, 40, 100], [50, 60, 70, 80, 90], [('host', 100)]),
+    'cascade of 8 late': ([1, 20, 30, 40, 100], [50, 60, 70, 80, 90], [('host', 1), ('host', 100)]),
+    'cascade of 7 (guest)': ([1, 2, 3, 4, 95], [5, 6, 7, 8, 100], [('guest', 8)]),
+}
+
+
+def play_deal(host_hand, guest_hand, plays):
+    appmod.random.sample = lambda population, k: host_hand + guest_hand
+    clients = {'host': appmod.socketio.test_client(appmod.app),
+               'guest': appmod.socketio.test_client(appmod.app)}
+    clients['host'].emit('create_room')
+    code = clients['host'].get_received()[0]['args'][0]['room_code']
+    clients['guest'].emit('join_room', {'room_code': code})
+    clients['host'].emit('start_round')
+
+    for player, value in plays:
+        observer = 'guest' if player == 'host' else 'host'
+        for client in clients.values():
+            client.get_received()
+        clients[player].emit('play_number', {'value': value})
+        clients[observer].emit('submit_input', {'input_data': '5'})
+    # Only the last play and its answer are measured
+    received = [message for client in clients.values() for message in client.get_received()]
+    for client in clients.values():
+        client.disconnect()
+    return received
+
+
+def main():
+    with appmod.app.app_context():
+        migrate(appmod.db.engine)
+    sample = appmod.random.sample
+    print(f"{'deal':<24}{'messages':>10}{'updates':>10}{'bytes':>8}")
+    try:
+        for name, (host_hand, guest_hand, plays) in DEALS.items():
+            received = play_deal(host_hand, guest_hand, plays)
+            updates = sum(1 for message in received if message['name'] == 'game_state_update')
+            size = sum(len(json.dumps(message['args'])) for message in received)
+            print(f"{name:<24}{len(received):>10}{updates:>10}{size:>8}")
+    finally:
+        appmod.random.sample = sample
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""Room affinity on a hash ring versus one fully shared room store.
+
+Simulates a cluster of WORKERS workers in one process, with ROOMS live
+rooms and EVENTS play events, each arriving at a random worker the way
+a load balancer would spread the sockets:
+
+    shared     every worker has its own connection to one SQLiteRoomStore
+               file and handles every event itself: lock, load the room
+               from JSON, change it, write it back
+    affinity   every worker keeps its rooms in a MemoryRoomStore; an event
+               for a room owned by another worker is forwarded to it with
+               Cluster.forward(), a real HTTP request over loopback
+
+and prints per-event latency for both. The shared store here is a local
+file, so it pays no network hop; a Redis store on another host would pay
+a round trip each for the lock, the get and the put, where a forwarded
+event pays one. Events the owner handles itself touch no store at all.
+It then counts how many of 100k room codes change owner when a worker is
+added to the ring, next to what plain hash(code) % workers would move.
+
+    python bench/cluster_affinity.py
+"""
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cluster import Cluster, HashRing, ring_hash  # noqa: E402
+from game_state import Room, RoundState  # noqa: E402
+from room_store import MemoryRoomStore, SQLiteRoomStore  # noqa: E402
+
+WORKERS = 4
+ROOMS = 2000
+EVENTS = 20000
+MOVE_CODES = 100000
+SECRET = 'bench'
+
+
+def room_codes(count):
+    codes = set()
+    while len(codes) < count:
+        codes.add(''.join(random.choices(string.ascii_uppercase, k=4)))
+    return sorted(codes)
+
+
+def new_room(code, now):
+    room = Room(f"{code}-a", now)
+    room.players.append(f"{code}-b")
+    room.state = RoundState(f"{code}-session")
+    room.state.status = 'playing'
+    room.state.hands = {room.players[0]: random.sample(range(1, 101), 5),
+                        room.players[1]: random.sample(range(1, 101), 5)}
+    return room
+
+
+def play(room, sid):
+    # Roughly what handle_play_number does to a room
+    room.state.plays.append(random.randint(1, 100), 0, room.players.index(sid), 0.5)
+    room.seq += 1
+    room.last_active = time.time()
+
+
+def percentiles(seconds):
+    ordered = sorted(seconds)
+    return [ordered[max(0, int(p / 100 * len(ordered)) - 1)] * 1e6 for p in (50, 99)]
+
+
+def bench_shared(codes, events):
+    path = tempfile.mktemp(suffix='.db')
+    stores = [SQLiteRoomStore(path) for _ in range(WORKERS)]
+    now = time.time()
+    for code in codes:
+        stores[0].add(code, new_room(code, now))
+
+    seconds = []
+    for code, worker in events:
+        store = stores[worker]
+        start = time.perf_counter()
+        with store.lock(code):
+            room = store.get(code)
+            play(room, f"{code}-a")
+            store.put(code, room)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+class Worker:
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.store = MemoryRoomStore()
+        worker = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not worker.cluster.authorized(self.headers.get('X-Cluster-Secret')):
+                    self.send_response(403)
+                else:
+                    body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                    worker.handle(body['args'][0], body['sid'])
+                    self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handle(self, code, sid):
+        with self.store.lock(code):
+            play(self.store.get(code), sid)
+
+    def event(self, code, sid):
+        owner = self.cluster.owner(code)
+        if owner == self.worker_id:
+            self.handle(code, sid)
+            return False
+        self.cluster.forward(owner, 'play_number', sid, [code])
+        return True
+
+
+def bench_affinity(codes, events):
+    workers = [Worker(f"w{i}") for i in range(WORKERS)]
+    urls = {worker.worker_id: worker.url for worker in workers}
+    for worker in workers:
+        worker.cluster = Cluster(worker.worker_id, urls, SECRET)
+    now = time.time()
+    by_id = {worker.worker_id: worker for worker in workers}
+    for code in codes:
+        by_id[workers[0].cluster.owner(code)].store.add(code, new_room(code, now))
+
+    local, forwarded = [], []
+    for code, worker in events:
+        start = time.perf_counter()
+        was_forwarded = workers[worker].event(code, f"{code}-a")
+        (forwarded if was_forwarded else local).append(time.perf_counter() - start)
+    for worker in workers:
+        worker.server.shutdown()
+        worker.server.server_close()
+    return local, forwarded
+
+
+def moved_fraction(codes, before, after):
+    return sum(before(code) != after(code) for code in codes) / len(codes)
+
+
+def main():
+    random.seed(1)
+    codes = room_codes(ROOMS)
+    events = [(random.choice(codes), random.randrange(WORKERS)) for _ in range(EVENTS)]
+
+    shared = bench_shared(codes, events)
+    local, forwarded = bench_affinity(codes, events)
+
+    print(f"{WORKERS} workers, {ROOMS} rooms, {EVENTS} events arriving at random workers\n")
+    print(f"{'':<28}{'events':>8}{'p50 us':>10}{'p99 us':>10}")
+    for name, seconds in (('shared SQLite store', shared),
+                          ('affinity, all events', local + forwarded),
+                          ('  handled by the owner', local),
+                          ('  forwarded to the owner', forwarded)):
+        p50, p99 = percentiles(seconds)
+        print(f"{name:<28}{len(seconds):>8}{p50:>10.1f}{p99:>10.1f}")
+
+    move_codes = room_codes(MOVE_CODES)
+    print(f"\nRoom codes that change owner going from n to n+1 workers ({len(move_codes)} codes):")
+    print(f"{'workers':<10}{'hash ring':>12}{'hash % n':>12}{'ideal':>10}")
+    for n in (2, 4, 8, 16):
+        ids = [f"w{i}" for i in range(n + 1)]
+        before, after = HashRing(ids[:n]), HashRing(ids)
+        ring = moved_fraction(move_codes, before.owner, after.owner)
+        modulo = moved_fraction(move_codes, lambda code: ring_hash(code) % n,
+                                lambda code: ring_hash(code) % (n + 1))
+        print(f"{n:>3} -> {n + 1:<3}{ring:>12.1%}{modulo:>12.1%}{1 / (n + 1):>10.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Rows per second saving 1k, 100k and 1M plays.
+
+Builds 60-play games of PlayRecords and saves them through store_plays()
+the way the persistence worker does: one transaction per batch of
+PERSIST_BATCH_SIZE games. Runs against a scratch SQLite file, and also
+against Postgres when POSTGRES_URL is set. For Postgres the psycopg2
+wait callback is installed first, as in the app, so the bulk insert is
+measured while it yields to the hub. The sessions it creates there are
+deleted again at the end.
+
+    python bench/insert_rows.py
+    POSTGRES_URL=postgresql://localhost/scratch python bench/insert_rows.py
+"""
+import eventlet
+eventlet.monkey_patch()
+
+import os  # noqa: E402
+import sys  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+import uuid  # noqa: E402
+
+import sqlalchemy as sa  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cooperative_db import setup_cooperative_db  # noqa: E402
+from game_state import PlayRecord  # noqa: E402
+from migrations import migrate  # noqa: E402
+from models import GameRound, GameSession, Participant, RoundPlay, store_plays  # noqa: E402
+
+PLAY_COUNTS = (1000, 100000, 1000000)
+PLAYS_PER_GAME = 60
+BATCH_GAMES = int(os.environ.get('PERSIST_BATCH_SIZE', 50))
+
+
+def make_game(key, now):
+    records = []
+    for i in range(PLAYS_PER_GAME):
+        round_number, play_number = divmod(i, 10)
+        set_number = 1 if round_number < 3 else 2
+        records.append(PlayRecord(
+            key, round_number + 1, set_number, play_number + 1, f"{key}-{i % 2}",
+            i + 1, 0.8, i % 7 == 0, 3 if set_number == 1 else 12, now + i,
+            None if set_number == 1 else '12', 0.001))
+    return records
+
+
+def cleanup(engine, prefix):
+    with engine.begin() as conn:
+        sessions = sa.select(GameSession.id).where(GameSession.session_key.like(prefix + '%'))
+        rounds = sa.select(GameRound.id).where(GameRound.session_id.in_(sessions))
+        conn.execute(sa.delete(RoundPlay).where(RoundPlay.round_id.in_(rounds)))
+        conn.execute(sa.delete(GameRound).where(GameRound.session_id.in_(sessions)))
+        conn.execute(sa.delete(Participant).where(Participant.session_id.in_(sessions)))
+        conn.execute(sa.delete(GameSession).where(GameSession.session_key.like(prefix + '%')))
+
+
+def bench(engine, play_count):
+    prefix = f"bench-{uuid.uuid4().hex[:8]}-"
+    now = time.time()
+    games = [make_game(f"{prefix}{i}", now) for i in range(play_count // PLAYS_PER_GAME + 1)]
+    records = [record for game in games for record in game][:play_count]
+    batch_size = BATCH_GAMES * PLAYS_PER_GAME
+
+    start = time.perf_counter()
+    for i in range(0, len(records), batch_size):
+        with engine.begin() as conn:
+            store_plays(conn, records[i:i + batch_size])
+    elapsed = time.perf_counter() - start
+
+    with engine.connect() as conn:
+        saved = conn.execute(
+            sa.select(sa.func.count()).select_from(RoundPlay)
+            .join(GameRound, RoundPlay.round_id == GameRound.id)
+            .join(GameSession, GameRound.session_id == GameSession.id)
+            .where(GameSession.session_key.like(prefix + '%'))).scalar()
+    cleanup(engine, prefix)
+    assert saved == play_count, (saved, play_count)
+    return elapsed
+
+
+def main():
+    urls = {'sqlite': 'sqlite:///' + tempfile.mktemp(suffix='.db')}
+    if os.environ.get('POSTGRES_URL'):
+        urls['postgres'] = os.environ['POSTGRES_URL']
+
+    engines = {}
+    for name, url in urls.items():
+        setup_cooperative_db(url)
+        engines[name] = sa.create_engine(url)
+        migrate(engines[name])
+
+    print(f"{'database':<10}{'plays':>10}{'seconds':>10}{'rows/s':>12}")
+    for name, engine in engines.items():
+        for play_count in PLAY_COUNTS:
+            elapsed = bench(engine, play_count)
+            print(f"{name:<10}{play_count:>10}{elapsed:>10.2f}{play_count / elapsed:>12.0f}")
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Handler latency with 10, 1k and 50k live rooms.
+
+Fills the in-process room store with idle rooms, then times a real
+Socket.IO round trip (request_snapshot, which looks up the sender's room
+by sid) through the Flask-SocketIO test client, plus the bare
+get_room_code_for_sid() lookup. With the sid -> room index both should
+stay flat as the room count grows.
+
+    python bench/room_lookup.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + tempfile.mktemp(suffix='.db'))
+os.environ.setdefault('LOG_LEVEL', 'error')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app as appmod  # noqa: E402
+from game_state import Room  # noqa: E402
+from room_store import MemoryRoomStore  # noqa: E402
+
+ROOM_COUNTS = (10, 1000, 50000)
+CALLS = 2000
+
+
+def fill(store, count):
+    now = time.time()
+    for i in range(count):
+        code = f"F{i:06d}"
+        room = Room(f"{code}-a", now)
+        room.players.append(f"{code}-b")
+        store.add(code, room)
+        store.bind_sid(f"{code}-a", code)
+        store.bind_sid(f"{code}-b", code)
+
+
+def bench(room_count):
+    appmod.room_store = MemoryRoomStore()
+    host = appmod.socketio.test_client(appmod.app)
+    guest = appmod.socketio.test_client(appmod.app)
+    host.emit('create_room')
+    code = host.get_received()[0]['args'][0]['room_code']
+    guest.emit('join_room', {'room_code': code})
+    host.emit('start_round')
+    fill(appmod.room_store, room_count - 1)
+    host.get_received()
+
+    start = time.perf_counter()
+    for _ in range(CALLS):
+        host.emit('request_snapshot')
+        host.get_received()
+    handler = (time.perf_counter() - start) / CALLS
+
+    sid = appmod.room_store.rooms[code].players[0]
+    start = time.perf_counter()
+    for _ in range(CALLS * 50):
+        appmod.get_room_code_for_sid(sid)
+    lookup = (time.perf_counter() - start) / (CALLS * 50)
+
+    host.disconnect()
+    guest.disconnect()
+    return handler, lookup
+
+
+def main():
+    print(f"{'rooms':>8}{'request_snapshot us':>22}{'sid lookup us':>16}")
+    for room_count in ROOM_COUNTS:
+        handler, lookup = bench(room_count)
+        print(f"{room_count:>8}{handler * 1e6:>22.1f}{lookup * 1e6:>16.3f}")
+
+
+if __name__ == '__main__':
+    main()
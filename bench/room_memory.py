@@ -0,0 +1,120 @@
+"""Memory per room at 100k mid-game rooms, old dict layout versus Room.
+
+Builds ROOMS rooms twice, each caught halfway through round 4: 30 plays
+buffered from the first three rounds, 5 cards on the board, 5 left in
+hand and a play waiting on the observer's answer. Once with the nested
+dicts the handlers used before game_state.py (a dict per play on the
+board and per buffered play), once with Room/RoundState/PlayLog and
+PlayRecord tuples. Each build runs under tracemalloc and the traced
+bytes are divided by the room count. Socket ids and session keys are
+made beforehand, since both layouts only hold references to them.
+
+    python bench/room_memory.py
+"""
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from game_state import PlayLog, PlayRecord, Room, RoundState  # noqa: E402
+
+ROOMS = 100000
+BUFFERED = 30
+ON_BOARD = 5
+
+
+def deal():
+    # (host hand, guest hand, cards on the board, buffered plays) for one room
+    cards = sorted(random.sample(range(1, 101), 10))
+    board = [(cards[i], i % 2, random.random() * 3, False) for i in range(ON_BOARD)]
+    hands = ([c for c in cards[ON_BOARD:] if c % 2], [c for c in cards[ON_BOARD:] if not c % 2])
+    buffered = [(i // 10 + 1, 1, i % 10 + 1, i % 2, random.randint(1, 100),
+                 random.random() * 3, i % 7 == 0, str(random.randint(1, 10)), time.time() + i)
+                for i in range(BUFFERED)]
+    return hands, board, buffered
+
+
+def dict_room(code, sids, session_key, hands, board, buffered, now):
+    room = {'players': list(sids), 'game_state': {}, 'seq': 12, 'last_active': now}
+    played = [{'value': value, 'isMistake': mistake, 'player_sid': sids[player],
+               'time_played': seconds} for value, player, seconds, mistake in board]
+    room['game_state'] = {
+        'game_data_buffer': [dict(
+            game_session_id=code, round_number=round_number, set_number=set_number,
+            play_number_in_round=play_number, player_sid=sids[player], value_played=value,
+            time_since_previous=seconds, was_mistake=mistake, observer_input=observer_input)
+            for (round_number, set_number, play_number, player, value, seconds, mistake,
+                 observer_input, _) in buffered],
+        'round_number': 4,
+        'set_number': 2,
+        'mistake_count': 0,
+        'game_status': 'waiting_for_input',
+        'play_start_time': now,
+        'all_played_list': played,
+        'hands': {sids[0]: list(hands[0]), sids[1]: list(hands[1])},
+        'pending_inputs': {},
+        'board_sent': ON_BOARD,
+        'temp_play_data': played[-1],
+        'observer_sid': sids[1],
+        'actor_sid': sids[0],
+    }
+    return room
+
+
+def slots_room(code, sids, session_key, hands, board, buffered, now):
+    room = Room(sids[0], now)
+    room.players.append(sids[1])
+    room.seq = 12
+    state = room.state = RoundState(session_key)
+    state.round_number = 4
+    state.set_number = 2
+    state.status = 'waiting_for_input'
+    state.play_start_time = now
+    state.hands = {sids[0]: list(hands[0]), sids[1]: list(hands[1])}
+    state.plays = PlayLog()
+    for value, player, seconds, mistake in board:
+        state.plays.append(value, mistake, player, seconds)
+    state.board_sent = ON_BOARD
+    state.pending_play = ON_BOARD - 1
+    state.observer_sid = sids[1]
+    state.actor_sid = sids[0]
+    state.buffer = [PlayRecord(session_key, round_number, set_number, play_number, sids[player],
+                               value, seconds, mistake, int(observer_input), played_at,
+                               None, 0.001)
+                    for (round_number, set_number, play_number, player, value, seconds, mistake,
+                         observer_input, played_at) in buffered]
+    return room
+
+
+def traced_bytes(build, games):
+    gc.collect()
+    tracemalloc.start()
+    now = time.time()
+    rooms = {code: build(code, sids, key, *deal_, now) for code, sids, key, deal_ in games}
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rooms
+    return size
+
+
+def main():
+    random.seed(1)
+    games = [(f"{i:06d}", (f"sid-{i:016d}-a", f"sid-{i:016d}-b"), f"session-{i:08d}", deal())
+             for i in range(ROOMS)]
+
+    print(f"{ROOMS} mid-game rooms, {BUFFERED} buffered plays and {ON_BOARD} on the board each\n")
+    print(f"{'layout':<24}{'MB':>10}{'bytes/room':>12}")
+    results = {}
+    for name, build in (('nested dicts', dict_room), ('Room + PlayLog', slots_room)):
+        results[name] = traced_bytes(build, games)
+        print(f"{name:<24}{results[name] / 2**20:>10.1f}{results[name] / ROOMS:>12.0f}")
+    print(f"\nRoom + PlayLog uses {results['Room + PlayLog'] / results['nested dicts']:.0%} "
+          f"of the dict layout's memory")
+
+
+if __name__ == '__main__':
+    main()
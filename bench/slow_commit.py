@@ -0,0 +1,98 @@
+"""Other rooms during a slow commit, with database calls on tpool.
+
+Holds SQLite's write lock from a separate connection for HOLD seconds,
+so every commit meanwhile waits inside a tpool thread, and starts SAVES
+inline saves behind it, more than the 15 connections SQLAlchemy's
+default pool would hand out. While they wait, another room keeps sending
+request_snapshot through the test client. Its round trips should stay
+near their idle level, and every save should land right after the lock
+is released instead of waiting out pool_timeout (or, with the default
+pool's green locks in real threads, hanging for good).
+
+    python bench/slow_commit.py
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + tempfile.mktemp(suffix='.db'))
+os.environ.setdefault('LOG_LEVEL', 'error')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import eventlet  # noqa: E402
+
+import app as appmod  # noqa: E402
+from game_state import PlayRecord  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+HOLD = 2.0
+SAVES = 32
+
+
+def flush(i):
+    record = PlayRecord(f"slow-{i}", 1, 1, 1, f"sid-{i}", i + 1, 0.5, False, None, time.time())
+    return (f"slow-{i}", [record], False)
+
+
+def snapshot_round_trips(client, until):
+    seconds = []
+    while not until():
+        start = time.perf_counter()
+        client.emit('request_snapshot')
+        client.get_received()
+        seconds.append(time.perf_counter() - start)
+        # Let the waiting saves' greenlets check in, as other sockets would
+        eventlet.sleep(0)
+    return sorted(seconds)
+
+
+def summary(seconds):
+    return (f"{len(seconds):>7}{seconds[len(seconds) // 2] * 1000:>10.2f}"
+            f"{seconds[-1] * 1000:>10.2f}")
+
+
+def main():
+    with appmod.app.app_context():
+        engine = appmod.db.engine
+        migrate(engine)
+    print(f"db mode {appmod.db_mode}, {type(engine.pool).__name__}")
+
+    host = appmod.socketio.test_client(appmod.app)
+    guest = appmod.socketio.test_client(appmod.app)
+    host.emit('create_room')
+    code = host.get_received()[0]['args'][0]['room_code']
+    guest.emit('join_room', {'room_code': code})
+    host.emit('start_round')
+    host.get_received()
+
+    deadline = time.monotonic() + 1
+    idle = snapshot_round_trips(host, lambda: time.monotonic() > deadline)
+
+    locker = sqlite3.connect(engine.url.database, isolation_level=None)
+    locker.execute("BEGIN IMMEDIATE")
+    released = []
+
+    def release():
+        locker.execute("COMMIT")
+        released.append(time.monotonic())
+
+    start = time.monotonic()
+    eventlet.spawn_after(HOLD, release)
+    saves = [eventlet.spawn(appmod.commit_play_batch, [flush(i)]) for i in range(SAVES)]
+    during = snapshot_round_trips(host, lambda: all(save.dead for save in saves))
+    saved = sum(save.wait() for save in saves)
+    done = time.monotonic()
+
+    print(f"{'':<24}{'events':>7}{'p50 ms':>10}{'max ms':>10}")
+    print(f"{'idle':<24}{summary(idle)}")
+    print(f"{'during the slow commit':<24}{summary(during)}")
+    print(f"\n{saved}/{SAVES} saves committed {done - released[0]:.2f}s after the "
+          f"{HOLD:.0f}s lock was released ({done - start:.2f}s in all)")
+    host.disconnect()
+    guest.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Room affinity across worker processes.
+
+Each room code is owned by exactly one worker, picked with a consistent
+hash ring, and the room's state only ever lives in that worker's memory.
+A worker that receives an event for a room it doesn't own posts it to the
+owner, which runs the handler as if the event had arrived there. Emits
+still reach the right sockets through the Socket.IO message queue.
+
+Configure every worker with the same CLUSTER_WORKERS list plus its own
+WORKER_ID:
+
+    CLUSTER_WORKERS="a=http://10.0.0.1:5000,b=http://10.0.0.2:5000"
+    WORKER_ID=a
+    CLUSTER_SECRET=<shared secret for the forwarding endpoint>
+
+Because each worker appears on the ring many times (virtual nodes),
+adding or removing a worker only moves about 1/N of the room codes.
+"""
+import bisect
+import hashlib
+import hmac
+import json
+import urllib.request
+
+VIRTUAL_NODES = 160
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    def __init__(self, worker_ids, virtual_nodes=VIRTUAL_NODES):
+        points = []
+        for worker_id in worker_ids:
+            for i in range(virtual_nodes):
+                points.append((ring_hash(f"{worker_id}#{i}"), worker_id))
+        points.sort()
+        self.hashes = [h for h, _ in points]
+        self.owners = [worker_id for _, worker_id in points]
+
+    def owner(self, key):
+        i = bisect.bisect(self.hashes, ring_hash(key))
+        return self.owners[i % len(self.owners)]
+
+
+class Cluster:
+    def __init__(self, worker_id, workers, secret):
+        if worker_id not in workers:
+            raise ValueError(f"WORKER_ID {worker_id!r} is not in CLUSTER_WORKERS")
+        self.worker_id = worker_id
+        self.workers = workers
+        self.secret = secret
+        self.ring = HashRing(sorted(workers))
+
+    def owner(self, room_code):
+        return self.ring.owner(room_code)
+
+    def authorized(self, secret):
+        # Constant time, so the secret can't be guessed byte by byte
+        return hmac.compare_digest((secret or '').encode(), self.secret.encode())
+
+    def owns(self, room_code):
+        return self.owner(room_code) == self.worker_id
+
+    def forward(self, owner, event, sid, args):
+        body = json.dumps({'event': event, 'sid': sid, 'args': list(args)}).encode()
+        req = urllib.request.Request(
+            f"{self.workers[owner]}/internal/room-event",
+            data=body,
+            headers={'Content-Type': 'application/json',
+                     'X-Cluster-Secret': self.secret})
+        # urllib is green under eventlet, so this only blocks this handler
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            return resp.status
+
+
+def make_cluster(worker_id, workers_spec, secret):
+    if not workers_spec:
+        return None
+    if not secret:
+        # Otherwise anyone who can reach a worker could post events as any sid
+        raise ValueError("CLUSTER_SECRET must be set when CLUSTER_WORKERS is")
+    workers = {}
+    for entry in workers_spec.split(','):
+        name, _, url = entry.strip().partition('=')
+        workers[name] = url.rstrip('/')
+    return Cluster(worker_id, workers, secret)
@@ -0,0 +1,83 @@
+"""Keep database calls from freezing the eventlet hub.
+
+psycopg2 talks to Postgres through blocking C socket calls, so without
+help a slow commit stalls every room on the worker. For Postgres we
+install a wait callback that hands each socket wait back to the hub (the
+same trick psycogreen uses). Other drivers have no such hook, so their
+work is pushed onto eventlet's OS thread pool instead, and the engine
+gets a pool that is safe to use from those threads (engine_options()).
+
+The mode is picked from the DATABASE_URL dialect and driver:
+
+    postgres://, postgresql://, postgresql+psycopg2://   'wait_callback'
+    anything else (including postgresql+psycopg://)     'tpool'
+
+psycopg2 refuses to run COPY while a wait callback is installed, so
+nothing here uses COPY; bulk reads and writes stick to ordinary queries.
+"""
+from eventlet import tpool
+from eventlet.hubs import trampoline
+from eventlet.semaphore import Semaphore
+from sqlalchemy.pool import NullPool
+
+try:
+    import psycopg2
+    from psycopg2 import extensions as psycopg2_extensions
+except ImportError:
+    psycopg2 = None
+
+
+def eventlet_wait_callback(conn, timeout=-1):
+    while True:
+        state = conn.poll()
+        if state == psycopg2_extensions.POLL_OK:
+            break
+        elif state == psycopg2_extensions.POLL_READ:
+            trampoline(conn.fileno(), read=True)
+        elif state == psycopg2_extensions.POLL_WRITE:
+            trampoline(conn.fileno(), write=True)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state}")
+
+
+def setup_cooperative_db(database_url):
+    if not database_url:
+        return None
+    dialect, _, driver = database_url.split(':', 1)[0].partition('+')
+    # The callback is psycopg2's; other Postgres drivers (psycopg 3, pg8000)
+    # would block the hub without it, so they get the thread pool
+    if dialect in ('postgres', 'postgresql') and driver in ('', 'psycopg2') and psycopg2 is not None:
+        psycopg2_extensions.set_wait_callback(eventlet_wait_callback)
+        return 'wait_callback'
+    return 'tpool'
+
+
+def engine_options(mode):
+    # SQLAlchemy's default QueuePool guards its connections with threading
+    # locks, which monkey_patch turned into green ones. Those can't be
+    # waited on from a tpool thread, so once more threads want a connection
+    # than the pool holds, they hang. NullPool has no locks to wait on.
+    if mode == 'tpool':
+        return {'poolclass': NullPool}
+    return {}
+
+
+# The engine's first connection sets up the dialect under another
+# threading lock, so the first tpool call goes through on its own.
+first_tpool_call = Semaphore()
+tpool_ready = False
+
+
+def run_db(mode, func, *args):
+    # func has to push its own app context, since a tpool thread doesn't
+    # share the calling greenlet's context.
+    global tpool_ready
+    if mode == 'tpool':
+        if not tpool_ready:
+            with first_tpool_call:
+                if not tpool_ready:
+                    result = tpool.execute(func, *args)
+                    tpool_ready = True
+                    return result
+        return tpool.execute(func, *args)
+    return func(*args)
@@ -0,0 +1,166 @@
+"""Streaming writers for the play export.
+
+Every writer takes the column names, their Python types and an iterator
+of pages (lists of row tuples from a keyset query) and yields bytes as it
+goes, so an export never has to build the whole file in memory:
+
+    csv       plain CSV
+    csv.gz    the same CSV, gzip-compressed on the fly
+    jsonl     one JSON object per play
+    npz       NumPy arrays, one per column (needs numpy)
+    parquet   Parquet, one row group per page (needs pyarrow)
+
+npz is a zip of whole columns, so each page is spilled column by column
+to temporary files and the columns are written out at the end, a page at
+a time. The others emit one chunk per page.
+"""
+import contextlib
+import csv
+import io
+import json
+import tempfile
+import zipfile
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file that hands back what was written since the last drain()."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def write_csv(columns, types, pages):
+    si = io.StringIO()
+    cw = csv.writer(si)
+
+    cw.writerow(columns)
+    yield si.getvalue().encode()
+
+    for rows in pages:
+        si.seek(0)
+        si.truncate(0)
+        cw.writerows(rows)
+        yield si.getvalue().encode()
+
+
+def gzip_chunks(chunks):
+    # wbits=31 gives a gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def write_csv_gz(columns, types, pages):
+    return gzip_chunks(write_csv(columns, types, pages))
+
+
+def write_jsonl(columns, types, pages):
+    for rows in pages:
+        yield ''.join(json.dumps(dict(zip(columns, row)), separators=(',', ':')) + '\n'
+                      for row in rows).encode()
+
+
+def page_array(values, kind):
+    if kind is str:
+        return numpy.array(['' if v is None else v for v in values], dtype=str)
+    if kind is bool:
+        return numpy.array(values, dtype=bool)
+    if None in values:
+        # Nullable numbers become floats with NaN for the gaps
+        return numpy.array([numpy.nan if v is None else v for v in values], dtype='float64')
+    return numpy.array(values, dtype='int64' if kind is int else 'float64')
+
+
+def write_npz(columns, types, pages):
+    with contextlib.ExitStack() as stack:
+        # One spill file per column, and the (dtype, length) of each page in it
+        spills = [stack.enter_context(tempfile.TemporaryFile()) for _ in columns]
+        parts = [[] for _ in columns]
+        for rows in pages:
+            for spill, column_parts, kind, values in zip(spills, parts, types, zip(*rows)):
+                array = page_array(list(values), kind)
+                array.tofile(spill)
+                column_parts.append((array.dtype, len(array)))
+
+        sink = ChunkSink()
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name, kind, spill, column_parts in zip(columns, types, spills, parts):
+                # Pages differ in string width, and a page with gaps turns
+                # the whole column into floats, as concatenating them would
+                if column_parts:
+                    dtype = numpy.result_type(*[part_dtype for part_dtype, _ in column_parts])
+                else:
+                    dtype = page_array([], kind).dtype
+                header = {'descr': numpy.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+                          'shape': (sum(length for _, length in column_parts),)}
+                spill.seek(0)
+                with zf.open(f"{name}.npy", 'w', force_zip64=True) as f:
+                    numpy.lib.format.write_array_header_1_0(f, header)
+                    for part_dtype, length in column_parts:
+                        f.write(numpy.fromfile(spill, part_dtype, length).astype(dtype, copy=False).tobytes())
+                        yield sink.drain()
+                yield sink.drain()
+        yield sink.drain()
+
+
+ARROW_TYPES = {
+    int: 'int64',
+    float: 'float64',
+    bool: 'bool_',
+    str: 'string',
+}
+
+
+def write_parquet(columns, types, pages):
+    schema = pyarrow.schema([(name, getattr(pyarrow, ARROW_TYPES[kind])())
+                             for name, kind in zip(columns, types)])
+    sink = ChunkSink()
+    with pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd') as writer:
+        for rows in pages:
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(values, type=field.type)
+                 for values, field in zip(zip(*rows), schema)], schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+# name: (mimetype, file extension, writer, available)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv', write_csv, True),
+    'csv.gz': ('application/gzip', 'csv.gz', write_csv_gz, True),
+    'jsonl': ('application/x-ndjson', 'jsonl', write_jsonl, True),
+    'npz': ('application/x-npz', 'npz', write_npz, numpy is not None),
+    'parquet': ('application/vnd.apache.parquet', 'parquet', write_parquet, pyarrow is not None),
+}
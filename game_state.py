@@ -0,0 +1,140 @@
+"""In-memory model of a room and the game being played in it.
+
+Rooms are the most numerous objects on the server, so these classes use
+__slots__ and each round's board is kept in flat arrays rather than a list
+of dicts. to_dict()/from_dict() turn a room into plain JSON friendly data
+for the shared room stores.
+"""
+from array import array
+from collections import namedtuple
+
+
+class PlayLog:
+    """Cards played so far this round, oldest first."""
+    __slots__ = ('values', 'mistakes', 'players', 'times')
+
+    def __init__(self):
+        self.values = array('B')    # card value, 0-100
+        self.mistakes = array('B')  # 1 if the card was played out of order
+        self.players = array('B')   # index into Room.players
+        self.times = array('d')     # seconds since the previous play, 0 for cascade plays
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, value, is_mistake, player, time_played):
+        self.values.append(value)
+        self.mistakes.append(is_mistake)
+        self.players.append(player)
+        self.times.append(time_played)
+
+    def public(self, start=0, stop=None):
+        # What the clients get to see of each play
+        stop = len(self.values) if stop is None else stop
+        return [{'value': self.values[i], 'isMistake': bool(self.mistakes[i])}
+                for i in range(start, stop)]
+
+    def played_by(self, player, start=0, stop=None):
+        stop = len(self.values) if stop is None else stop
+        return [self.values[i] for i in range(start, stop) if self.players[i] == player]
+
+    def to_dict(self):
+        return {'values': self.values.tolist(), 'mistakes': self.mistakes.tolist(),
+                'players': self.players.tolist(), 'times': self.times.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        log = cls()
+        log.values.extend(data['values'])
+        log.mistakes.extend(data['mistakes'])
+        log.players.extend(data['players'])
+        log.times.extend(data['times'])
+        return log
+
+
+class PlayRecord(namedtuple('PlayRecord', (
+        'game_session_id', 'round_number', 'set_number', 'play_number_in_round',
+        'player_sid', 'value_played', 'time_since_previous', 'was_mistake',
+        'observer_input', 'time_played_at', 'observer_input_raw', 'hub_lag'),
+        defaults=(None, None, None))):
+    """A play waiting to be written to the play table.
+
+    A plain tuple, so a flush can hand rows straight to a bulk insert.
+    Field names match the Play columns.
+    """
+    __slots__ = ()
+
+    def as_row(self):
+        return self._asdict()
+
+
+class RoundState:
+    """The game in progress in a room, plus plays not yet flushed."""
+    __slots__ = ('session_id', 'round_number', 'set_number', 'mistake_count', 'status',
+                 'play_start_time', 'hands', 'plays', 'board_sent', 'pending_play',
+                 'observer_sid', 'actor_sid', 'buffer')
+
+    def __init__(self, session_id):
+        # Unique per game, unlike room codes which get reused
+        self.session_id = session_id
+        self.round_number = 1
+        self.set_number = 0
+        self.mistake_count = 0
+        self.status = 'pending'
+        self.play_start_time = None
+        self.hands = {}
+        self.plays = PlayLog()
+        # How much of the board has been broadcast
+        self.board_sent = 0
+        # Index in plays of the play waiting on the observer's input
+        self.pending_play = None
+        self.observer_sid = None
+        self.actor_sid = None
+        self.buffer = []
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data['plays'] = self.plays.to_dict()
+        data['buffer'] = [record.as_row() for record in self.buffer]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(state, name, data[name])
+        state.plays = PlayLog.from_dict(data['plays'])
+        state.buffer = [PlayRecord(**row) for row in data['buffer']]
+        return state
+
+
+class Room:
+    __slots__ = ('players', 'state', 'seq', 'last_active', 'closed')
+
+    def __init__(self, player_sid, now):
+        self.players = [player_sid]
+        # RoundState once the first round starts
+        self.state = None
+        # Bumped on every board broadcast so clients can order deltas
+        self.seq = 0
+        self.last_active = now
+        self.closed = False
+
+    def to_dict(self):
+        return {
+            'players': self.players,
+            'state': self.state.to_dict() if self.state else None,
+            'seq': self.seq,
+            'last_active': self.last_active,
+            'closed': self.closed,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        room = cls.__new__(cls)
+        room.players = data['players']
+        room.state = RoundState.from_dict(data['state']) if data['state'] else None
+        room.seq = data['seq']
+        room.last_active = data['last_active']
+        room.closed = data['closed']
+        return room
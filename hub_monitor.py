@@ -0,0 +1,130 @@
+"""Watches the eventlet hub for stalls and slow handlers.
+
+Every room on a worker shares one hub, so anything that blocks it (a
+synchronous database call, a big export, a slow write) holds up every
+other player, and the timings we record server-side (time_since_previous)
+come out too long.
+
+A greenthread sleeps for a short interval over and over and measures how
+late it wakes up: that is the hub lag. Lags above the stall threshold are
+kept with the wall clock time they covered, so max_lag_between() can tell
+how far a play's timing may be off.
+
+A real OS thread, the watchdog, looks at the handlers in progress and
+captures the stack of any that has run past the slow threshold: the hub
+thread's current frame if the handler is blocking the hub, or the
+greenlet's suspended frame if it is waiting on something. It only queues
+what it found; the monitor greenthread logs it and counts it, on the hub.
+"""
+import functools
+import sys
+import time
+import traceback
+from collections import deque
+
+import eventlet
+import greenlet
+from eventlet import patcher
+
+# The watchdog has to be a real thread that really sleeps
+real_threading = patcher.original('threading')
+real_time = patcher.original('time')
+
+
+class HubMonitor:
+    def __init__(self, log, lag_histogram, slow_counter, interval=0.02,
+                 slow_threshold=0.1, stall_threshold=0.005, max_stalls=4096):
+        self.log = log
+        self.lag_histogram = lag_histogram
+        self.slow_counter = slow_counter
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.stall_threshold = stall_threshold
+        # (start, end) wall clock times of recent stalls, oldest first
+        self.stalls = deque(maxlen=max_stalls)
+        self.last_lag = 0.0
+        self.due = None
+        # greenlet -> (event, perf_counter at start) for handlers in progress
+        self.active = {}
+        self.reports = deque()
+        self.hub_thread = None
+
+    def start(self):
+        # Called on the hub thread, which is what the watchdog samples
+        self.hub_thread = real_threading.get_ident()
+        eventlet.spawn(self.run)
+        real_threading.Thread(target=self.watch, name='hub-watchdog', daemon=True).start()
+
+    def run(self):
+        while True:
+            self.due = time.perf_counter() + self.interval
+            eventlet.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - self.due)
+            self.last_lag = lag
+            self.lag_histogram.observe(lag)
+            if lag >= self.stall_threshold:
+                now = time.time()
+                self.stalls.append((now - lag, now))
+            while self.reports:
+                self.report(*self.reports.popleft())
+
+    def current_lag(self):
+        """How late the monitor already is, i.e. how long the hub has been stuck."""
+        if self.due is None:
+            return 0.0
+        return max(0.0, time.perf_counter() - self.due)
+
+    def max_lag_between(self, start, end):
+        """Longest stall overlapping the wall clock interval [start, end]."""
+        worst = 0.0
+        pending = self.current_lag()
+        if pending >= self.stall_threshold and time.time() - pending <= end:
+            worst = pending
+        for stall_start, stall_end in reversed(self.stalls):
+            if stall_end < start:
+                break
+            if stall_start <= end:
+                worst = max(worst, stall_end - stall_start)
+        return worst
+
+    def watched(self, event, handler):
+        """Wrap handler so the watchdog can see it while it runs."""
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            if self.hub_thread is None:
+                self.start()
+            current = greenlet.getcurrent()
+            self.active[current] = (event, time.perf_counter())
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                self.active.pop(current, None)
+        return wrapper
+
+    def watch(self):
+        reported = set()
+        while True:
+            real_time.sleep(self.slow_threshold / 2)
+            now = time.perf_counter()
+            running = set()
+            for current, (event, start) in list(self.active.items()):
+                key = (id(current), start)
+                running.add(key)
+                if now - start < self.slow_threshold or key in reported:
+                    continue
+                reported.add(key)
+                # A greenlet that is running right now has no suspended frame
+                frame = current.gr_frame
+                blocking = frame is None
+                if blocking:
+                    frame = sys._current_frames().get(self.hub_thread)
+                stack = ''.join(traceback.format_stack(frame)) if frame else ''
+                self.reports.append((event, now - start, blocking, stack))
+            reported &= running
+
+    def report(self, event, elapsed, blocking, stack):
+        self.slow_counter.labels(event).inc()
+        self.log.warning("Handler %s still running after %.3fs%s", event, elapsed,
+                         ' and blocking the hub' if blocking else '',
+                         extra={'event': 'slow_handler', 'handler': event,
+                                'seconds': elapsed, 'blocking': blocking, 'stack': stack})
@@ -0,0 +1,291 @@
+"""Headless bots that play full games against a running server.
+
+Spins up --pairs pairs of Socket.IO clients. In each pair one bot creates
+a room, the other joins, and they play all 6 rounds: cards go down in
+order apart from deliberate mistakes (--mistake-rate), after a random
+think time around --play-delay, and the observer answers after about
+--input-delay. Every event is sent with an ack, so its round trip is the
+time until the server's handler has finished.
+
+At the end it prints p50/p95/p99 round trips per event, games and plays
+per second, errors, and the worker's memory and hub lag scraped from
+/metrics while the test ran. Run it against a local server before a
+release, e.g.
+
+    gunicorn -k eventlet -w 1 app:app &
+    python loadtest.py --url http://localhost:8000 --pairs 100 --ramp 10
+
+Needs the Socket.IO client: pip install "python-socketio[client]"
+"""
+import argparse
+import math
+import queue
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+import requests
+import socketio
+
+ROUNDS = 6
+
+
+class BotError(Exception):
+    pass
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.round_trips = defaultdict(list)
+        self.errors = Counter()
+        self.games = 0
+        self.plays = 0
+
+    def record(self, event, seconds):
+        with self.lock:
+            self.round_trips[event].append(seconds)
+
+    def error(self, kind):
+        with self.lock:
+            self.errors[kind] += 1
+
+
+class Bot:
+    def __init__(self, url, stats, timeout):
+        self.url = url
+        self.stats = stats
+        self.timeout = timeout
+        self.inbox = queue.Queue()
+        self.hand = []
+        self.seq = 0
+        # round_over or game_over, once the round has ended
+        self.finished = None
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('*', self.on_event)
+
+    def on_event(self, event, *args):
+        self.inbox.put((event, args[0] if args else None))
+
+    def connect(self):
+        start = time.perf_counter()
+        self.sio.connect(self.url, transports=['websocket'], wait_timeout=self.timeout)
+        self.stats.record('connect', time.perf_counter() - start)
+
+    def call(self, event, data=None):
+        start = time.perf_counter()
+        self.sio.call(event, data, timeout=self.timeout)
+        self.stats.record(event, time.perf_counter() - start)
+
+    def apply(self, event, data):
+        if event == 'game_started':
+            self.hand = list(data['hand'])
+            self.seq = data['seq']
+            self.finished = None
+        elif event in ('round_over', 'game_over'):
+            self.finished = event
+        elif event == 'game_state_update':
+            self.hand = [value for value in self.hand if value not in data['removed']]
+            self.seq = data['seq']
+        elif event == 'error_message':
+            raise BotError(f"error_message: {data['message']}")
+        elif event in ('room_expired', 'opponent_disconnected'):
+            raise BotError(event)
+
+    def next_event(self, deadline, wanted):
+        try:
+            event, data = self.inbox.get(timeout=max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            raise BotError(f"timed out waiting for {wanted}") from None
+        self.apply(event, data)
+        return event, data
+
+    def wait_for(self, wanted):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            event, data = self.next_event(deadline, wanted)
+            if event == wanted:
+                return data
+
+    def wait_for_seq(self, seq):
+        # Catch up with the partner: the server numbers every board change
+        deadline = time.monotonic() + self.timeout
+        while self.seq < seq:
+            self.next_event(deadline, f"seq {seq}")
+
+    def drain(self):
+        while True:
+            try:
+                self.apply(*self.inbox.get_nowait())
+            except queue.Empty:
+                return
+
+    def close(self):
+        self.sio.disconnect()
+
+
+def think(mean):
+    if mean > 0:
+        time.sleep(random.uniform(0.5 * mean, 1.5 * mean))
+
+
+def observer_answer(set_number):
+    # Set 1 asks how close they were to playing, set 2 what they counted to
+    return str(random.randint(1, 10) if set_number == 1 else random.randint(0, 60))
+
+
+def play_game(args, stats):
+    host = Bot(args.url, stats, args.timeout)
+    guest = Bot(args.guest_url or args.url, stats, args.timeout)
+    try:
+        host.connect()
+        guest.connect()
+        host.call('create_room')
+        room_code = host.wait_for('room_created')['room_code']
+        guest.call('join_room', {'room_code': room_code})
+        host.wait_for('game_ready')
+        guest.wait_for('game_ready')
+
+        for round_number in range(1, ROUNDS + 1):
+            set_number = 1 if round_number <= 3 else 2
+            # The first start_round deals twice, so go by the latest deal.
+            # Our own events arrive before the ack, the partner's may not have.
+            host.call('start_round')
+            host.drain()
+            guest.wait_for_seq(host.seq)
+
+            while host.hand or guest.hand:
+                cards = sorted(((value, bot) for bot in (host, guest) for value in bot.hand),
+                               key=lambda card: card[0])
+                if len(cards) > 1 and random.random() < args.mistake_rate:
+                    value, actor = random.choice(cards[1:])
+                else:
+                    value, actor = cards[0]
+                observer = guest if actor is host else host
+
+                think(args.play_delay)
+                actor.call('play_number', {'value': value})
+                observer.wait_for('request_input')
+                think(args.input_delay)
+                observer.call('submit_input', {'input_data': observer_answer(set_number)})
+                # Both hands are up to date once both have seen the same update
+                observer.drain()
+                actor.wait_for_seq(observer.seq)
+                with stats.lock:
+                    stats.plays += 1
+
+            last = 'game_over' if round_number == ROUNDS else 'round_over'
+            for bot in (host, guest):
+                if bot.finished != last:
+                    bot.wait_for(last)
+        with stats.lock:
+            stats.games += 1
+    except BotError as e:
+        stats.error(str(e))
+    except Exception as e:
+        stats.error(type(e).__name__)
+    finally:
+        for bot in (host, guest):
+            try:
+                bot.close()
+            except Exception:
+                pass
+
+
+class ServerWatcher(threading.Thread):
+    """Scrapes the worker's /metrics once a second."""
+
+    def __init__(self, url):
+        super().__init__(daemon=True)
+        self.url = url.rstrip('/') + '/metrics'
+        self.memory = []
+        self.hub_lag = []
+        self.stopped = threading.Event()
+
+    def scrape(self):
+        try:
+            text = requests.get(self.url, timeout=5).text
+        except requests.RequestException:
+            return
+        for line in text.splitlines():
+            name, _, value = line.partition(' ')
+            if name == 'process_resident_memory_bytes':
+                self.memory.append(float(value))
+            elif name == 'hub_lag_last_seconds':
+                self.hub_lag.append(float(value))
+
+    def run(self):
+        while not self.stopped.wait(1):
+            self.scrape()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.scrape()
+
+
+def percentile(ordered, p):
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def report(args, stats, watcher, elapsed):
+    print(f"{'event':<16}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    events = 0
+    for event, seconds in sorted(stats.round_trips.items()):
+        ordered = sorted(seconds)
+        events += len(ordered)
+        print(f"{event:<16}{len(ordered):>8}" + ''.join(
+            f"{percentile(ordered, p) * 1000:>10.1f}" for p in (50, 95, 99)))
+
+    print(f"\n{stats.games}/{args.pairs} games completed in {elapsed:.1f}s: "
+          f"{stats.plays / elapsed:.1f} plays/s, {events / elapsed:.1f} events/s")
+    if stats.errors:
+        print("Errors:")
+        for kind, count in stats.errors.most_common():
+            print(f"  {count:>6}  {kind}")
+    if watcher.memory:
+        mb = [value / 2**20 for value in watcher.memory]
+        print(f"Server memory: {mb[0]:.1f} MB at start, {max(mb):.1f} MB peak, {mb[-1]:.1f} MB at end")
+    else:
+        print("Server memory: /metrics not reachable")
+    if watcher.hub_lag:
+        print(f"Server hub lag: {max(watcher.hub_lag) * 1000:.1f} ms worst sample")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play full games with bot pairs and report latencies.")
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--guest-url', help="connect the joining bots to another worker instead")
+    parser.add_argument('--pairs', type=int, default=10, help="concurrent games")
+    parser.add_argument('--ramp', type=float, default=5.0, help="seconds over which to start the pairs")
+    parser.add_argument('--play-delay', type=float, default=0.5, help="mean seconds before each card")
+    parser.add_argument('--input-delay', type=float, default=0.5, help="mean seconds before each answer")
+    parser.add_argument('--mistake-rate', type=float, default=0.1,
+                        help="chance a card is not the lowest one left")
+    parser.add_argument('--timeout', type=float, default=30.0, help="seconds to wait for any reply")
+    args = parser.parse_args()
+
+    stats = Stats()
+    watcher = ServerWatcher(args.url)
+    watcher.scrape()
+    watcher.start()
+
+    start = time.monotonic()
+    threads = []
+    for pair in range(args.pairs):
+        thread = threading.Thread(target=play_game, args=(args, stats), daemon=True)
+        thread.start()
+        threads.append(thread)
+        if pair < args.pairs - 1:
+            time.sleep(args.ramp / (args.pairs - 1))
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    watcher.stop()
+    report(args, stats, watcher, elapsed)
+
+
+if __name__ == '__main__':
+    main()
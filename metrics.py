@@ -0,0 +1,156 @@
+"""In-process metrics in the Prometheus text format.
+
+Counters and histograms are plain Python objects updated in place, so
+recording an event costs a couple of perf_counter() calls, a bisect and a
+few additions; there is no locking because everything runs on the one
+eventlet hub thread. Gauges are computed from a callback when /metrics is
+scraped, so they cost nothing in between.
+
+Resolve the labelled child once (histogram.labels('play_number')) and
+keep it around, so the hot path skips the label lookup.
+"""
+import bisect
+import functools
+from time import perf_counter
+
+# Seconds; spans a fast handler (~100us) up to a slow database commit
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+registry = []
+
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.children = {}
+        registry.append(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = CounterChild()
+        return child
+
+    def samples(self):
+        for values, child in self.children.items():
+            yield f"{self.name}{format_labels(self.label_names, values)} {child.value}"
+
+
+class HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One slot per bucket plus +Inf; made cumulative when rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self.children = {}
+        registry.append(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = HistogramChild(self.buckets)
+        return child
+
+    def samples(self):
+        for values, child in self.children.items():
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                total += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                yield f"{self.name}_bucket{format_labels(self.label_names, values, le)} {total}"
+            labels = format_labels(self.label_names, values)
+            yield f"{self.name}_sum{labels} {child.sum}"
+            yield f"{self.name}_count{labels} {total}"
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, collect, label_names=()):
+        # collect() returns a number, or {label values tuple: number}
+        self.name = name
+        self.help_text = help_text
+        self.collect = collect
+        self.label_names = label_names
+        registry.append(self)
+
+    def samples(self):
+        value = self.collect()
+        if not isinstance(value, dict):
+            value = {(): value}
+        for values, number in value.items():
+            yield f"{self.name}{format_labels(self.label_names, values)} {number}"
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+def timed(histogram_child, error_counter_child=None):
+    """Decorator recording each call's duration (and any exception)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                if error_counter_child is not None:
+                    error_counter_child.inc()
+                raise
+            finally:
+                histogram_child.observe(perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def timed_iter(chunks, histogram_child):
+    """Pass chunks through, recording how long it took to consume them all."""
+    start = perf_counter()
+    try:
+        yield from chunks
+    finally:
+        histogram_child.observe(perf_counter() - start)
@@ -0,0 +1,373 @@
+"""Versioned schema migrations for the play tables.
+
+The models in models.py are the schema we want; these steps bring an
+existing database up to it. Applied versions are recorded in a
+schema_version table, and every step also checks the live schema first,
+so it is safe on a database that already has part of the change (e.g.
+one made by db.create_all()). Run them with
+
+    flask --app app migrate-db
+
+Nothing here holds a long lock on a big table. Backfills and clean-ups
+run in batches of sessions, each in its own short transaction, and on
+Postgres indexes are built CONCURRENTLY. Adding a column with a constant
+default is a metadata-only change on both SQLite and Postgres 11+.
+"""
+import time
+
+import sqlalchemy as sa
+
+from game_state import PlayRecord
+from models import db, play_rows, store_plays, SessionCompletion, OBSERVER_INPUT_RANGES
+
+BATCH_SESSIONS = 500
+BATCH_PLAYS = 5000
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return decorator
+
+
+def columns(conn, table='play'):
+    return {column['name'] for column in sa.inspect(conn).get_columns(table)}
+
+
+def indexes(conn, table='play'):
+    inspector = sa.inspect(conn)
+    names = {index['name'] for index in inspector.get_indexes(table)}
+    names.update(constraint['name'] for constraint in inspector.get_unique_constraints(table))
+    return names
+
+
+def session_batches(engine, where='', batch_size=BATCH_SESSIONS):
+    # Keyset walk over the session ids, so each batch is a short transaction
+    last = ''
+    while True:
+        with engine.connect() as conn:
+            sessions = conn.execute(sa.text(
+                f"SELECT DISTINCT game_session_id FROM play "
+                f"WHERE game_session_id > :last {where} "
+                f"ORDER BY game_session_id LIMIT :limit"),
+                {'last': last, 'limit': batch_size}).scalars().all()
+        if not sessions:
+            return
+        yield sessions
+        last = sessions[-1]
+
+
+def create_index(engine, name, columns_sql, unique=False, table='play'):
+    unique_sql = 'UNIQUE ' if unique else ''
+    if engine.dialect.name == 'postgresql':
+        # Builds without blocking writes; not allowed inside a transaction
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(sa.text(
+                f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns_sql})"))
+    else:
+        with engine.begin() as conn:
+            conn.execute(sa.text(
+                f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({columns_sql})"))
+
+
+def drop_index(engine, name):
+    if engine.dialect.name == 'postgresql':
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(sa.text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    else:
+        with engine.begin() as conn:
+            conn.execute(sa.text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def split_reused_codes(engine):
+    # The oldest rows used the room code as the session id, and codes were
+    # reused, so one id can hold several games. Each game was saved in one
+    # commit, so a game is a run of consecutive ids; a new one starts where
+    # the round number goes back down, or where the ids jump without the
+    # round moving on. Later games get the code plus -2, -3, ...
+    split = 0
+    for sessions in session_batches(engine):
+        with engine.begin() as conn:
+            rows = conn.execute(sa.text(
+                "SELECT id, game_session_id, round_number FROM play "
+                "WHERE game_session_id IN :sessions ORDER BY game_session_id, id")
+                .bindparams(sa.bindparam('sessions', expanding=True)),
+                {'sessions': sessions}).all()
+            games = []
+            previous = None
+            for play_id, session_id, round_number in rows:
+                if (previous is None or session_id != previous[1]
+                        or round_number < previous[2]
+                        or (play_id != previous[0] + 1 and round_number == previous[2])):
+                    games.append([session_id, play_id, play_id])
+                games[-1][2] = play_id
+                previous = (play_id, session_id, round_number)
+
+            number = {}
+            for session_id, first_id, last_id in games:
+                number[session_id] = number.get(session_id, 0) + 1
+                if number[session_id] == 1:
+                    continue
+                while True:
+                    new_id = f"{session_id}-{number[session_id]}"
+                    if not conn.execute(sa.text("SELECT 1 FROM play WHERE game_session_id = :id"),
+                                        {'id': new_id}).first():
+                        break
+                    number[session_id] += 1
+                conn.execute(sa.text(
+                    "UPDATE play SET game_session_id = :new WHERE game_session_id = :old "
+                    "AND id BETWEEN :first AND :last"),
+                    {'new': new_id, 'old': session_id, 'first': first_id, 'last': last_id})
+                split += 1
+    if split:
+        print(f"  split {split} games out of reused room codes")
+
+
+@migration(1, "Split reused room codes into games, reconcile time_played_at and time_since_previous")
+def reconcile_play_times(engine):
+    split_reused_codes(engine)
+
+    # Older databases stored the absolute time of each play in
+    # time_played_at, newer ones only the gap since the previous play.
+    # Keep both, and derive the gaps for the old rows.
+    with engine.connect() as conn:
+        existing = columns(conn)
+    if 'time_played_at' not in existing:
+        with engine.begin() as conn:
+            conn.execute(sa.text("ALTER TABLE play ADD COLUMN time_played_at FLOAT"))
+    if 'time_since_previous' in existing:
+        return
+    with engine.begin() as conn:
+        conn.execute(sa.text(
+            "ALTER TABLE play ADD COLUMN time_since_previous FLOAT NOT NULL DEFAULT 0"))
+
+    # The old rows don't record when each round started, so the first
+    # play of every round keeps 0.
+    for sessions in session_batches(engine):
+        with engine.begin() as conn:
+            rows = conn.execute(sa.text(
+                "SELECT id, game_session_id, round_number, time_played_at FROM play "
+                "WHERE game_session_id IN :sessions "
+                "ORDER BY game_session_id, round_number, play_number_in_round, id")
+                .bindparams(sa.bindparam('sessions', expanding=True)),
+                {'sessions': sessions}).all()
+            updates = []
+            previous_round = previous_time = None
+            for play_id, session_id, round_number, played_at in rows:
+                if (session_id, round_number) == previous_round:
+                    updates.append({'id': play_id, 'gap': played_at - previous_time})
+                previous_round, previous_time = (session_id, round_number), played_at
+            if updates:
+                conn.execute(sa.text(
+                    "UPDATE play SET time_since_previous = :gap WHERE id = :id"), updates)
+
+
+@migration(2, "Add game_complete")
+def add_game_complete(engine):
+    with engine.connect() as conn:
+        if 'game_complete' in columns(conn):
+            return
+    false = 'false' if engine.dialect.name == 'postgresql' else '0'
+    with engine.begin() as conn:
+        conn.execute(sa.text(
+            f"ALTER TABLE play ADD COLUMN game_complete BOOLEAN NOT NULL DEFAULT {false}"))
+
+    # Sessions that got through the last play of round 6 finished the game
+    finished = ("AND game_session_id IN (SELECT game_session_id FROM play "
+                "WHERE round_number >= 6 AND play_number_in_round = 10)")
+    for sessions in session_batches(engine, where=finished):
+        with engine.begin() as conn:
+            conn.execute(sa.text(
+                "UPDATE play SET game_complete = :complete WHERE game_session_id IN :sessions")
+                .bindparams(sa.bindparam('sessions', expanding=True)),
+                {'complete': True, 'sessions': sessions})
+
+
+@migration(3, "One row per (session, round, play number)")
+def add_play_key(engine):
+    with engine.connect() as conn:
+        if 'uq_play_session_round_play' in indexes(conn):
+            return
+        collisions = conn.execute(sa.text(
+            "SELECT DISTINCT game_session_id, round_number FROM play "
+            "GROUP BY game_session_id, round_number, play_number_in_round "
+            "HAVING COUNT(*) > 1")).all()
+
+    # Every row is a real play: when a hand emptied, the old code gave the
+    # actor's play the same number as the last cascade play. Number those
+    # rounds again in the order the plays were saved; nothing is deleted.
+    for start in range(0, len(collisions), BATCH_SESSIONS):
+        with engine.begin() as conn:
+            for session_id, round_number in collisions[start:start + BATCH_SESSIONS]:
+                ids = conn.execute(sa.text(
+                    "SELECT id FROM play WHERE game_session_id = :session AND round_number = :round "
+                    "ORDER BY id"), {'session': session_id, 'round': round_number}).scalars().all()
+                conn.execute(sa.text("UPDATE play SET play_number_in_round = :number WHERE id = :id"),
+                             [{'id': play_id, 'number': number}
+                              for number, play_id in enumerate(ids, 1)])
+    if collisions:
+        print(f"  renumbered plays in {len(collisions)} rounds with repeated play numbers")
+
+    create_index(engine, 'uq_play_session_round_play',
+                 'game_session_id, round_number, play_number_in_round', unique=True)
+    if engine.dialect.name == 'postgresql':
+        with engine.begin() as conn:
+            conn.execute(sa.text(
+                "ALTER TABLE play ADD CONSTRAINT uq_play_session_round_play "
+                "UNIQUE USING INDEX uq_play_session_round_play"))
+
+
+@migration(4, "Composite indexes for per-session and per-set queries")
+def add_analytics_indexes(engine):
+    create_index(engine, 'ix_play_set_mistake', 'set_number, was_mistake')
+    # Every lookup by session can use the leading column of the play key
+    drop_index(engine, 'ix_play_game_session_id')
+
+
+def copy_flat_plays(conn, last_id, limit=None):
+    query = ("SELECT id, game_session_id, round_number, set_number, play_number_in_round, "
+             "player_sid, value_played, time_since_previous, was_mistake, observer_input, "
+             "time_played_at, game_complete FROM play WHERE id > :last ORDER BY id")
+    params = {'last': last_id}
+    if limit:
+        query += " LIMIT :limit"
+        params['limit'] = limit
+    rows = conn.execute(sa.text(query), params).all()
+    if rows:
+        store_plays(conn, [PlayRecord(*row[1:11]) for row in rows])
+        complete = {row[1] for row in rows if row[11]}
+        if complete:
+            conn.execute(sa.text(
+                "UPDATE game_session SET game_complete = :complete WHERE session_key IN :keys")
+                .bindparams(sa.bindparam('keys', expanding=True)),
+                {'complete': True, 'keys': sorted(complete)})
+    return rows[-1][0] if rows else last_id
+
+
+def create_play_view(engine):
+    select_sql = play_rows.element.compile(dialect=engine.dialect,
+                                           compile_kwargs={'literal_binds': True})
+    with engine.begin() as conn:
+        conn.execute(sa.text("DROP VIEW IF EXISTS play"))
+        conn.execute(sa.text(f"CREATE VIEW play AS {select_sql}"))
+
+
+@migration(5, "Normalize plays into sessions, participants, rounds and round plays")
+def normalize_plays(engine):
+    with engine.connect() as conn:
+        if 'play' not in sa.inspect(conn).get_table_names():
+            return
+    db.metadata.create_all(engine)
+
+    # Copy in id order, one short transaction per batch
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            copied_to = copy_flat_plays(conn, last_id, BATCH_PLAYS)
+        if copied_to == last_id:
+            break
+        last_id = copied_to
+
+    # Pick up anything written meanwhile, then swap the table for the view
+    with engine.begin() as conn:
+        copy_flat_plays(conn, last_id)
+        conn.execute(sa.text("DROP TABLE play"))
+    create_play_view(engine)
+
+
+@migration(6, "Typed observer input with the raw text kept separately")
+def type_observer_input(engine):
+    with engine.connect() as conn:
+        if 'observer_input_raw' not in columns(conn, 'round_play'):
+            conn.execute(sa.text("ALTER TABLE round_play ADD COLUMN observer_input_raw VARCHAR(100)"))
+            conn.commit()
+        last_id = conn.execute(sa.text("SELECT MAX(id) FROM round_play")).scalar() or 0
+    create_play_view(engine)
+
+    # Numbers outside their set's range aren't valid answers; move them to
+    # the raw column, one id range per transaction.
+    valid = " OR ".join(
+        f"(game_round.set_number = {set_number} AND round_play.observer_input BETWEEN {low} AND {high})"
+        for set_number, (low, high) in OBSERVER_INPUT_RANGES.items())
+    for start in range(0, last_id, BATCH_PLAYS):
+        with engine.begin() as conn:
+            conn.execute(sa.text(
+                "UPDATE round_play SET observer_input_raw = CAST(observer_input AS VARCHAR(100)), "
+                "observer_input = NULL "
+                "WHERE id > :start AND id <= :end AND observer_input IS NOT NULL "
+                "AND NOT EXISTS (SELECT 1 FROM game_round "
+                f"WHERE game_round.id = round_play.round_id AND ({valid}))"),
+                {'start': start, 'end': start + BATCH_PLAYS})
+
+
+@migration(7, "Index round plays by time for incremental exports")
+def add_play_time_index(engine):
+    create_index(engine, 'ix_round_play_time_played_at', 'time_played_at', table='round_play')
+
+
+@migration(8, "Record hub lag per play")
+def add_hub_lag(engine):
+    with engine.connect() as conn:
+        if 'hub_lag' not in columns(conn, 'round_play'):
+            conn.execute(sa.text("ALTER TABLE round_play ADD COLUMN hub_lag FLOAT"))
+            conn.commit()
+    create_play_view(engine)
+
+
+@migration(9, "Record the order games complete in, for incremental exports")
+def add_session_completion(engine):
+    db.metadata.create_all(engine, tables=[SessionCompletion.__table__])
+    # Games completed before this have no order; number them by session id
+    with engine.begin() as conn:
+        conn.execute(sa.text(
+            "INSERT INTO session_completion (session_id) "
+            "SELECT id FROM game_session WHERE game_complete = :complete "
+            "AND id NOT IN (SELECT session_id FROM session_completion) ORDER BY id"),
+            {'complete': True})
+
+
+def current_version(engine):
+    with engine.begin() as conn:
+        conn.execute(sa.text(
+            "CREATE TABLE IF NOT EXISTS schema_version "
+            "(version INTEGER PRIMARY KEY, description VARCHAR(200) NOT NULL, applied_at FLOAT NOT NULL)"))
+        return conn.execute(sa.text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+def record_version(engine, version, description):
+    with engine.begin() as conn:
+        conn.execute(sa.text(
+            "INSERT INTO schema_version (version, description, applied_at) "
+            "VALUES (:version, :description, :applied_at)"),
+            {'version': version, 'description': description, 'applied_at': time.time()})
+
+
+def migrate(engine):
+    """Apply every migration newer than the database. Returns the versions applied."""
+    version = current_version(engine)
+    with engine.connect() as conn:
+        inspector = sa.inspect(conn)
+        # Without a flat play table (as opposed to the view) there is no
+        # old data to migrate
+        fresh = version == 0 and 'play' not in inspector.get_table_names()
+    if fresh:
+        # Nothing to migrate, build the current schema straight from the models
+        db.metadata.create_all(engine)
+        create_play_view(engine)
+        print("Created play tables from the models.")
+
+    applied = []
+    for number, description, func in sorted(MIGRATIONS):
+        if number <= version:
+            continue
+        if not fresh:
+            print(f"Applying migration {number}: {description}")
+            start = time.time()
+            func(engine)
+            print(f"  done in {time.time() - start:.2f}s")
+        record_version(engine, number, description)
+        applied.append(number)
+    return applied
@@ -0,0 +1,262 @@
+"""Database schema for saved plays.
+
+Plays are stored normalized: a game_session row per game, its
+participants and rounds, and one narrow round_play row per card played
+that points at them by integer id. The session key, player sid, round
+and set are stored once instead of on every play.
+
+play_rows is the old flat layout (one row per play with everything
+repeated) as a query. The CSV export reads from it, and the migrations
+create a database view named play from it for anything that still
+expects the flat table.
+"""
+from flask_sqlalchemy import SQLAlchemy
+
+try:
+    from psycopg2 import extras as psycopg2_extras
+except ImportError:
+    psycopg2_extras = None
+
+db = SQLAlchemy()
+
+
+class GameSession(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    # RoundState.session_id, unique per game
+    session_key = db.Column(db.String(50), nullable=False, unique=True)
+    # Set once every round of the game is saved; abandoned games stay False
+    game_complete = db.Column(db.Boolean, nullable=False, default=False)
+
+    def __repr__(self):
+        return f'<GameSession {self.id} ({self.session_key})>'
+
+
+class SessionCompletion(db.Model):
+    # One row per game, in the order the games completed. game_complete is
+    # set on sessions whose plays may have been exported long before, so
+    # incremental exports follow these ids instead (see export_data).
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('game_session.id'), nullable=False, unique=True)
+
+
+class Participant(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('game_session.id'), nullable=False)
+    player_sid = db.Column(db.String(100))
+
+    __table_args__ = (
+        db.UniqueConstraint('session_id', 'player_sid', name='uq_participant_session_sid'),
+    )
+
+
+class GameRound(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('game_session.id'), nullable=False)
+    round_number = db.Column(db.SmallInteger, nullable=False)
+    set_number = db.Column(db.SmallInteger, nullable=False)
+
+    # The unique index doubles as the per-session index
+    __table_args__ = (
+        db.UniqueConstraint('session_id', 'round_number', name='uq_game_round_session_round'),
+        db.Index('ix_game_round_set', 'set_number'),
+    )
+
+
+class RoundPlay(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    round_id = db.Column(db.Integer, db.ForeignKey('game_round.id'), nullable=False)
+    play_number = db.Column(db.SmallInteger, nullable=False)
+    participant_id = db.Column(db.Integer, db.ForeignKey('participant.id'), nullable=False)
+    value_played = db.Column(db.SmallInteger, nullable=False)
+    time_since_previous = db.Column(db.Float, nullable=False)
+    # Wall clock time of the play; missing on rows migrated from databases
+    # that didn't record it
+    time_played_at = db.Column(db.Float)
+    was_mistake = db.Column(db.Boolean, nullable=False)
+    # The observer's answer, see OBSERVER_INPUT_RANGES. NULL for cascade
+    # plays, and for answers that aren't a valid number for the set, whose
+    # text is kept in observer_input_raw instead.
+    observer_input = db.Column(db.SmallInteger)
+    observer_input_raw = db.Column(db.String(100))
+    # Longest eventlet hub stall (seconds) while this play was being timed,
+    # see hub_monitor.py. Large values mean time_since_previous is inflated.
+    hub_lag = db.Column(db.Float)
+
+    # Plays are flushed per round and retried, so each play has one key.
+    # The time index serves incremental exports by since_time.
+    __table_args__ = (
+        db.UniqueConstraint('round_id', 'play_number', name='uq_round_play_round_play'),
+        db.Index('ix_round_play_time_played_at', 'time_played_at'),
+    )
+
+    def __repr__(self):
+        return f'<RoundPlay {self.id} (Round: {self.round_id} Play: {self.play_number})>'
+
+
+# One row per play in the old flat layout, in the old column names
+play_rows = (
+    db.select(
+        RoundPlay.id.label('id'),
+        GameSession.session_key.label('game_session_id'),
+        GameRound.round_number.label('round_number'),
+        GameRound.set_number.label('set_number'),
+        RoundPlay.play_number.label('play_number_in_round'),
+        Participant.player_sid.label('player_sid'),
+        RoundPlay.value_played.label('value_played'),
+        RoundPlay.time_since_previous.label('time_since_previous'),
+        RoundPlay.was_mistake.label('was_mistake'),
+        RoundPlay.observer_input.label('observer_input'),
+        GameSession.game_complete.label('game_complete'),
+        RoundPlay.time_played_at.label('time_played_at'),
+        RoundPlay.observer_input_raw.label('observer_input_raw'),
+        RoundPlay.hub_lag.label('hub_lag'),
+    )
+    .join(GameRound, RoundPlay.round_id == GameRound.id)
+    .join(GameSession, GameRound.session_id == GameSession.id)
+    .join(Participant, RoundPlay.participant_id == Participant.id)
+    .subquery('play_rows')
+)
+
+
+# Valid observer answers per set (inclusive)
+OBSERVER_INPUT_RANGES = {
+    1: (1, 10),      # how close they were to playing
+    2: (0, 32767),   # the number they had counted to, anything that fits the column
+}
+
+
+def parse_observer_input(set_number, text):
+    """Split an observer's answer into (number, raw text), one of them None."""
+    if text is None:
+        return None, None
+    text = str(text)
+    try:
+        number = int(text.strip())
+    except ValueError:
+        return None, text[:100]
+    low, high = OBSERVER_INPUT_RANGES[set_number]
+    if low <= number <= high:
+        return number, None
+    return None, text[:100]
+
+
+def resolve_ids(conn, table, parent_column, parents, key_column, wanted, extra=None):
+    """Map (parent, key) pairs to row ids in table, inserting the missing ones."""
+    def lookup():
+        rows = conn.execute(
+            db.select(table.c.id, table.c[parent_column], table.c[key_column])
+            .where(table.c[parent_column].in_(list(parents)))).all()
+        return {(parent, key): row_id for row_id, parent, key in rows}
+
+    ids = lookup()
+    missing = [pair for pair in wanted if pair not in ids]
+    if missing:
+        conn.execute(table.insert(), [
+            {parent_column: parent, key_column: key, **(extra(parent, key) if extra else {})}
+            for parent, key in missing])
+        ids = lookup()
+    return ids
+
+
+# (round_id, play_number) pairs per DELETE; with the round ids that is
+# at most three bind parameters a pair, well under SQLite's and Postgres's
+# limits
+DELETE_CHUNK = 5000
+
+
+def store_plays(conn, records):
+    """Upsert PlayRecords into the normalized tables on conn.
+
+    Rows already saved under the same (session, round, play number) are
+    replaced, so a retried or repeated flush never duplicates plays. A
+    reset round reuses play numbers, so the latest record wins.
+    """
+    latest = {}
+    for record in records:
+        latest[(record.game_session_id, record.round_number, record.play_number_in_round)] = record
+    if not latest:
+        return
+    records = list(latest.values())
+
+    session_keys = {record.game_session_id for record in records}
+    sessions = conn.execute(
+        db.select(GameSession.session_key, GameSession.id)
+        .where(GameSession.session_key.in_(list(session_keys)))).all()
+    session_ids = dict(sessions)
+    missing = session_keys - session_ids.keys()
+    if missing:
+        conn.execute(GameSession.__table__.insert(),
+                     [{'session_key': key, 'game_complete': False} for key in missing])
+        session_ids.update(conn.execute(
+            db.select(GameSession.session_key, GameSession.id)
+            .where(GameSession.session_key.in_(list(missing)))).all())
+
+    set_numbers = {(session_ids[r.game_session_id], r.round_number): r.set_number for r in records}
+    round_ids = resolve_ids(
+        conn, GameRound.__table__, 'session_id', set(session_ids.values()), 'round_number',
+        set_numbers, extra=lambda session_id, round_number: {
+            'set_number': set_numbers[(session_id, round_number)]})
+    participant_ids = resolve_ids(
+        conn, Participant.__table__, 'session_id', set(session_ids.values()), 'player_sid',
+        {(session_ids[r.game_session_id], r.player_sid) for r in records})
+
+    rows = []
+    for r in records:
+        session_id = session_ids[r.game_session_id]
+        observer_input, observer_input_raw = r.observer_input, r.observer_input_raw
+        if isinstance(observer_input, str):
+            # Older records (journal, legacy table) still carry the text
+            observer_input, observer_input_raw = parse_observer_input(r.set_number, observer_input)
+        rows.append((round_ids[(session_id, r.round_number)], r.play_number_in_round,
+                     participant_ids[(session_id, r.player_sid)], r.value_played,
+                     r.time_since_previous, r.time_played_at, r.was_mistake,
+                     observer_input, observer_input_raw, r.hub_lag))
+
+    # One DELETE for the whole batch rather than one per round. Deleting
+    # and reinserting (not an upsert) gives a re-saved play a new id, which
+    # incremental exports rely on to send it again.
+    # The round_id list lets SQLite search the unique index; it won't use
+    # it for the row-value IN on its own.
+    keys = [row[:2] for row in rows]
+    for i in range(0, len(keys), DELETE_CHUNK):
+        chunk = keys[i:i + DELETE_CHUNK]
+        conn.execute(db.delete(RoundPlay).where(
+            RoundPlay.round_id.in_(sorted({round_id for round_id, _ in chunk})),
+            db.tuple_(RoundPlay.round_id, RoundPlay.play_number).in_(chunk)))
+    insert_round_plays(conn, rows)
+
+
+ROUND_PLAY_COLUMNS = ('round_id', 'play_number', 'participant_id', 'value_played',
+                      'time_since_previous', 'time_played_at', 'was_mistake', 'observer_input',
+                      'observer_input_raw', 'hub_lag')
+
+
+def insert_round_plays(conn, rows):
+    # Core bulk insert of plain tuples, skipping the ORM unit of work. On
+    # psycopg2 the tuples go straight to execute_values() as multi-row
+    # INSERTs. Unlike COPY that is ordinary query traffic, so it keeps
+    # yielding to the hub through the wait callback (see cooperative_db.py).
+    if conn.dialect.driver == 'psycopg2':
+        cursor = conn.connection.dbapi_connection.cursor()
+        psycopg2_extras.execute_values(
+            cursor,
+            f"INSERT INTO {RoundPlay.__tablename__} ({', '.join(ROUND_PLAY_COLUMNS)}) VALUES %s",
+            rows, page_size=1000)
+    else:
+        conn.execute(RoundPlay.__table__.insert(),
+                     [dict(zip(ROUND_PLAY_COLUMNS, row)) for row in rows])
+
+
+def mark_sessions_complete(conn, session_keys):
+    # Only sessions completing now get a completion row
+    session_ids = conn.execute(
+        db.select(GameSession.id)
+        .where(GameSession.session_key.in_(session_keys), GameSession.game_complete.is_(False))
+        .order_by(GameSession.id)).scalars().all()
+    if not session_ids:
+        return
+    conn.execute(db.update(GameSession)
+                 .where(GameSession.id.in_(session_ids))
+                 .values(game_complete=True))
+    conn.execute(SessionCompletion.__table__.insert(),
+                 [{'session_id': session_id} for session_id in session_ids])
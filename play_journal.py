@@ -0,0 +1,215 @@
+"""Append-only journal of buffered plays.
+
+A play sits in a room's buffer, and then in the persistence queue, for up
+to a round before it is committed. Set PLAY_JOURNAL_DIR and every play is
+also appended to a local journal as it is buffered, so a crash or kill
+loses at most the last fsync interval instead of every unsaved round.
+
+Workers sharing PLAY_JOURNAL_DIR each journal into their own
+subdirectory, worker-0, worker-1 and so on, which they hold an flock on
+for as long as they run. A worker that starts after a crash takes the
+first free one, along with whatever the crashed worker left in it. Each
+is a directory of JSON Lines segments, oldest first:
+
+    worker-0/plays-00000001.jsonl
+    worker-0/plays-00000002.jsonl
+
+Each line is either {"play": [...PlayRecord fields...]} or
+{"complete": session_id} for a finished game. Writes go into a buffered
+file and a background task fsyncs them as a group every
+JOURNAL_FSYNC_INTERVAL seconds on eventlet's thread pool, so appending a
+play never waits on the disk. Segments rotate at JOURNAL_SEGMENT_BYTES
+and are deleted once everything in them (and in every older segment) has
+been committed. Segments left behind by a crash are replayed into the
+database on startup.
+
+Each journal keeps track of exactly which entries it wrote: the play
+records themselves, and the sessions it marked complete. A commit only
+settles entries that are the same as ones this journal wrote, whichever
+order flushes commit in. With a shared room store, a round can end and
+be saved on another worker, so the app also checks rotated_pending(),
+this journal's entries still waiting in rotated segments, against the
+database every so often and settles the ones already saved.
+"""
+import fcntl
+import json
+import os
+from collections import Counter
+
+from eventlet import tpool
+
+from game_state import PlayRecord
+
+SEGMENT_BYTES = 4 * 1024 * 1024
+
+
+def claim_directory(root):
+    """Lock the first free worker directory under root; returns (path, lock file)."""
+    slot = 0
+    while True:
+        directory = os.path.join(root, f"worker-{slot}")
+        os.makedirs(directory, exist_ok=True)
+        lock_file = open(os.path.join(directory, 'lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Another live worker's journal
+            lock_file.close()
+            slot += 1
+        else:
+            return directory, lock_file
+
+
+class PlayJournal:
+    def __init__(self, root, segment_bytes=SEGMENT_BYTES):
+        self.directory, self.lock_file = claim_directory(root)
+        self.segment_bytes = segment_bytes
+        # Segments already on disk are from a previous run, see replay()
+        self.leftover = self.segment_numbers()
+        self.number = max(self.leftover, default=0)
+        # Uncommitted entries in each of our segments, oldest first: the
+        # PlayRecord for a play, ('complete', session_id) for a finished game
+        self.pending = {}
+        # Descriptors of rotated segments that still need an fsync
+        self.unsynced = []
+        self.file = None
+        self.dirty = False
+        self.open_segment()
+
+    def segment_numbers(self):
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith('plays-') and name.endswith('.jsonl'):
+                numbers.append(int(name[len('plays-'):-len('.jsonl')]))
+        return sorted(numbers)
+
+    def path(self, number):
+        return os.path.join(self.directory, f"plays-{number:08d}.jsonl")
+
+    def remove(self, number):
+        try:
+            os.remove(self.path(number))
+        except FileNotFoundError:
+            # Removed by hand, nothing left to lose
+            pass
+
+    def open_segment(self):
+        self.number += 1
+        self.file = open(self.path(self.number), 'a', encoding='utf-8')
+        self.pending[self.number] = Counter()
+
+    def rotate(self):
+        self.file.flush()
+        self.unsynced.append(os.dup(self.file.fileno()))
+        self.file.close()
+        self.open_segment()
+        self.retire()
+
+    def write(self, key, entry):
+        self.file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self.pending[self.number][key] += 1
+        self.dirty = True
+        if self.file.tell() >= self.segment_bytes:
+            self.rotate()
+
+    def append_play(self, record):
+        self.write(record, {'play': record})
+
+    def append_complete(self, session_id):
+        self.write(('complete', session_id), {'complete': session_id})
+
+    def committed(self, records, complete_session=None):
+        """Settle a committed flush: its records, and its session if the game ended."""
+        keys = list(records)
+        if complete_session is not None:
+            keys.append(('complete', complete_session))
+        self.settle(keys)
+
+    def settle(self, keys):
+        # Only entries this journal wrote; a flush journaled by another
+        # worker, or replayed from an older run, matches nothing here.
+        for key in keys:
+            for counts in self.pending.values():
+                if counts[key]:
+                    counts[key] -= 1
+                    if not counts[key]:
+                        del counts[key]
+                    break
+        self.retire()
+
+    def rotated_pending(self):
+        """Entries still pending in rotated segments, oldest segment first."""
+        return [key for number, counts in self.pending.items() if number != self.number
+                for key in counts]
+
+    def retire(self):
+        # Only drop whole segments from the front, so replay never applies
+        # an old copy of a play over a newer one that was already deleted.
+        for number in list(self.pending):
+            if number == self.number or self.pending[number]:
+                break
+            del self.pending[number]
+            self.remove(number)
+
+    def sync(self):
+        if not self.dirty and not self.unsynced:
+            return
+        self.file.flush()
+        self.dirty = False
+        fds, self.unsynced = self.unsynced, []
+        fds.append(os.dup(self.file.fileno()))
+        for fd in fds:
+            try:
+                # fsync can take milliseconds, keep it off the hub
+                tpool.execute(os.fsync, fd)
+            finally:
+                os.close(fd)
+
+    def close(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        for fd in self.unsynced:
+            os.fsync(fd)
+            os.close(fd)
+        self.unsynced = []
+        if not self.pending[self.number]:
+            self.remove(self.number)
+        self.lock_file.close()
+
+    def read_segment(self, number):
+        """Group a segment's entries into (session_id, records, game_complete) flushes."""
+        records = {}
+        complete = set()
+        with open(self.path(number), encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn write at the tail from the crash
+                    break
+                if 'play' in entry:
+                    record = PlayRecord(*entry['play'])
+                    records.setdefault(record.game_session_id, []).append(record)
+                else:
+                    complete.add(entry['complete'])
+                    records.setdefault(entry['complete'], [])
+        return [(session_id, session_records, session_id in complete)
+                for session_id, session_records in records.items()]
+
+    def replay(self, save):
+        """Hand segments left by a previous run to save(batch), oldest first.
+
+        Each segment is deleted once save() returns True. Replay stops at
+        the first failure so the rest are retried, in order, next time.
+        """
+        replayed = 0
+        while self.leftover:
+            number = self.leftover[0]
+            batch = self.read_segment(number)
+            if batch and not save(batch):
+                break
+            self.remove(number)
+            self.leftover.pop(0)
+            replayed += sum(len(records) for _, records, _ in batch)
+        return replayed
@@ -0,0 +1,119 @@
+"""On-demand profiling for a live worker, behind the admin endpoints.
+
+profile_stacks() samples stacks from a real OS thread for a fixed time:
+the hub thread's current stack (whatever greenlet is running, or the hub
+itself when idle) plus the suspended stack of every handler greenlet the
+hub monitor knows about, labelled with its event. The result is in the
+collapsed format flamegraph.pl and speedscope read, one line per stack:
+
+    hub;run (.../hub.py:330);wait (.../poll.py:80) 1234
+
+trace_allocations() turns tracemalloc on for a fixed time and returns the
+lines that allocated the most in that window.
+
+Nothing runs or is traced outside a request, and only one profile runs
+at a time.
+"""
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+import eventlet
+from eventlet import patcher
+
+real_threading = patcher.original('threading')
+real_time = patcher.original('time')
+
+MAX_SECONDS = 60
+
+running = False
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+@contextmanager
+def exclusive():
+    global running
+    if running:
+        raise ProfilerBusy()
+    running = True
+    try:
+        yield
+    finally:
+        running = False
+
+
+def frame_name(frame):
+    code = frame.f_code
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f"{name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def collapse(frame):
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def sample(counts, hub_thread, waiting, seconds, interval):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        frame = sys._current_frames().get(hub_thread)
+        if frame is not None:
+            counts['hub;' + collapse(frame)] += 1
+        for event, current in waiting():
+            frame = current.gr_frame
+            if frame is not None:
+                counts[f'waiting {event};' + collapse(frame)] += 1
+        real_time.sleep(interval)
+
+
+def profile_stacks(seconds, interval, waiting=lambda: ()):
+    """Sample for seconds; returns the collapsed stacks as text.
+
+    waiting() gives (label, greenlet) pairs whose suspended stacks to
+    include. Must be called on the hub thread.
+    """
+    with exclusive():
+        counts = Counter()
+        sampler = real_threading.Thread(
+            target=sample, name='stack-sampler', daemon=True,
+            args=(counts, real_threading.get_ident(), waiting, seconds, interval))
+        sampler.start()
+        # Wait without blocking the hub we are sampling
+        while sampler.is_alive():
+            eventlet.sleep(0.05)
+    return ''.join(f'{stack} {count}\n' for stack, count in counts.most_common())
+
+
+def trace_allocations(seconds, top):
+    """Trace allocations for seconds; returns the top lines by size as a dict."""
+    with exclusive():
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        try:
+            eventlet.sleep(seconds)
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started:
+                tracemalloc.stop()
+
+    snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+    return {
+        'seconds': seconds,
+        'traced_bytes': current,
+        'peak_traced_bytes': peak,
+        'top': [{'file': stat.traceback[0].filename,
+                 'line': stat.traceback[0].lineno,
+                 'size_bytes': stat.size,
+                 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:top]],
+    }
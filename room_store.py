@@ -0,0 +1,197 @@
+"""Where live rooms are kept.
+
+A single eventlet worker only needs MemoryRoomStore. To run several
+workers, point ROOM_STORE_URL at a shared store so any worker can handle
+any event for any room:
+
+    memory://                   (default) plain dict in this process
+    sqlite:////tmp/rooms.db     shared file, good for tests and one host
+    redis://localhost:6379/0    shared across hosts, needs the redis package
+
+Shared stores keep rooms as JSON via Room.to_dict()/Room.from_dict().
+Handlers change a room while holding lock(room_code) and write it back
+with put().
+"""
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from game_state import Room
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class MemoryRoomStore:
+    def __init__(self):
+        self.rooms = {}
+        self.sids = {}
+        self.locks = {}
+
+    def get(self, room_code):
+        return self.rooms.get(room_code)
+
+    def add(self, room_code, room):
+        if room_code in self.rooms:
+            return False
+        self.rooms[room_code] = room
+        return True
+
+    def put(self, room_code, room):
+        self.rooms[room_code] = room
+
+    def delete(self, room_code):
+        self.locks.pop(room_code, None)
+        return self.rooms.pop(room_code, None)
+
+    def room_for_sid(self, sid):
+        return self.sids.get(sid)
+
+    def bind_sid(self, sid, room_code):
+        self.sids[sid] = room_code
+
+    def unbind_sid(self, sid, room_code):
+        if self.sids.get(sid) == room_code:
+            del self.sids[sid]
+
+    def lock(self, room_code):
+        # A handler can yield to the hub while it holds a room (an inline
+        # save when the persist queue is full, an emit through a message
+        # queue), so other greenlets wait their turn on a per-room lock.
+        # threading is monkey-patched, so this is a green lock.
+        lock = self.locks.get(room_code)
+        if lock is None:
+            lock = self.locks[room_code] = threading.RLock()
+        return lock
+
+    def __len__(self):
+        return len(self.rooms)
+
+
+class SQLiteRoomStore:
+    def __init__(self, path):
+        self.path = path
+        # Autocommit mode; lock() opens an explicit write transaction
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS rooms (code TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS room_sids (sid TEXT PRIMARY KEY, code TEXT NOT NULL)")
+        # The connection is shared by every greenlet in this process
+        self.local_lock = threading.RLock()
+
+    def get(self, room_code):
+        with self.local_lock:
+            row = self.conn.execute("SELECT data FROM rooms WHERE code = ?", (room_code,)).fetchone()
+        return Room.from_dict(json.loads(row[0])) if row else None
+
+    def add(self, room_code, room):
+        with self.local_lock:
+            cur = self.conn.execute("INSERT OR IGNORE INTO rooms (code, data) VALUES (?, ?)",
+                                    (room_code, json.dumps(room.to_dict())))
+        return cur.rowcount == 1
+
+    def put(self, room_code, room):
+        with self.local_lock:
+            self.conn.execute("INSERT OR REPLACE INTO rooms (code, data) VALUES (?, ?)",
+                              (room_code, json.dumps(room.to_dict())))
+
+    def delete(self, room_code):
+        with self.local_lock:
+            room = self.get(room_code)
+            self.conn.execute("DELETE FROM rooms WHERE code = ?", (room_code,))
+        return room
+
+    def room_for_sid(self, sid):
+        with self.local_lock:
+            row = self.conn.execute("SELECT code FROM room_sids WHERE sid = ?", (sid,)).fetchone()
+        return row[0] if row else None
+
+    def bind_sid(self, sid, room_code):
+        with self.local_lock:
+            self.conn.execute("INSERT OR REPLACE INTO room_sids (sid, code) VALUES (?, ?)",
+                              (sid, room_code))
+
+    def unbind_sid(self, sid, room_code):
+        with self.local_lock:
+            self.conn.execute("DELETE FROM room_sids WHERE sid = ? AND code = ?", (sid, room_code))
+
+    @contextmanager
+    def lock(self, room_code):
+        # BEGIN IMMEDIATE takes the database write lock, which serializes
+        # room updates across every worker process sharing the file.
+        with self.local_lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            else:
+                self.conn.execute("COMMIT")
+
+    def __len__(self):
+        with self.local_lock:
+            return self.conn.execute("SELECT COUNT(*) FROM rooms").fetchone()[0]
+
+
+class RedisRoomStore:
+    def __init__(self, url, prefix='coordination:', lock_timeout=10):
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.lock_timeout = lock_timeout
+
+    def key(self, room_code):
+        return f"{self.prefix}room:{room_code}"
+
+    def get(self, room_code):
+        data = self.redis.get(self.key(room_code))
+        return Room.from_dict(json.loads(data)) if data else None
+
+    def add(self, room_code, room):
+        if not self.redis.set(self.key(room_code), json.dumps(room.to_dict()), nx=True):
+            return False
+        self.redis.sadd(f"{self.prefix}rooms", room_code)
+        return True
+
+    def put(self, room_code, room):
+        self.redis.set(self.key(room_code), json.dumps(room.to_dict()))
+
+    def delete(self, room_code):
+        pipe = self.redis.pipeline()
+        pipe.get(self.key(room_code))
+        pipe.delete(self.key(room_code))
+        pipe.srem(f"{self.prefix}rooms", room_code)
+        data = pipe.execute()[0]
+        return Room.from_dict(json.loads(data)) if data else None
+
+    def room_for_sid(self, sid):
+        return self.redis.hget(f"{self.prefix}sids", sid)
+
+    def bind_sid(self, sid, room_code):
+        self.redis.hset(f"{self.prefix}sids", sid, room_code)
+
+    def unbind_sid(self, sid, room_code):
+        if self.room_for_sid(sid) == room_code:
+            self.redis.hdel(f"{self.prefix}sids", sid)
+
+    def lock(self, room_code):
+        return self.redis.lock(f"{self.prefix}lock:{room_code}", timeout=self.lock_timeout)
+
+    def __len__(self):
+        return self.redis.scard(f"{self.prefix}rooms")
+
+
+def make_room_store(url=None):
+    if not url or url.startswith('memory://'):
+        return MemoryRoomStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteRoomStore(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://')):
+        if redis is None:
+            raise RuntimeError("ROOM_STORE_URL is a redis URL but the redis package is not installed")
+        return RedisRoomStore(url)
+    raise ValueError(f"Unsupported ROOM_STORE_URL: {url}")
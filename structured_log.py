@@ -0,0 +1,147 @@
+"""Structured logging that stays off the eventlet hub.
+
+Handlers only put the LogRecord on a queue. A real OS thread (not a green
+one) takes records off it, formats them and writes them out, so a slow or
+captured stdout never stalls the hub and formatting costs the request
+greenlet nothing. If the queue ever fills up, records are dropped and
+counted rather than blocking.
+
+Pass context as fields with extra=, e.g.
+
+    log.info("Round started", extra={'event': 'round_started', 'room': code, 'round': 2})
+
+so every line carries event, room, round, sid, ... as separate keys.
+Only pass plain values in args and extra: they are formatted later, on
+the logging thread.
+
+Configuration:
+
+    LOG_LEVEL          INFO by default
+    LOG_FORMAT         json (default, one object per line) or text
+    LOG_SAMPLE_RATES   fraction of DEBUG records kept per event, e.g.
+                       "card_played=0.1,play_buffered=0.1" (the default)
+"""
+import atexit
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+from eventlet import patcher
+
+# The unpatched modules, so the writer is a real thread on a real queue
+real_threading = patcher.original('threading')
+real_queue = patcher.original('queue')
+
+QUEUE_SIZE = 10000
+DEFAULT_SAMPLE_RATES = 'card_played=0.1,play_buffered=0.1'
+
+# Attributes every LogRecord has; anything else came in through extra=
+RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def record_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in RECORD_ATTRS}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))
+                    + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'msg': record.getMessage(),
+        }
+        entry.update(record_fields(record))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = ' '.join(f'{key}={value}' for key, value in record_fields(record).items())
+        return f'{line} {fields}' if fields else line
+
+
+class SampleFilter(logging.Filter):
+    """Keeps only a fraction of DEBUG records for each sampled event."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = self.rates.get(getattr(record, 'event', None))
+        return rate is None or random.random() < rate
+
+
+class QueueingHandler(logging.Handler):
+    def __init__(self, queue):
+        super().__init__()
+        self.queue = queue
+        self.dropped = 0
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except real_queue.Full:
+            self.dropped += 1
+
+
+class LogWriter:
+    """Real thread that formats and writes queued records."""
+
+    def __init__(self, queue, handler):
+        self.queue = queue
+        self.handler = handler
+        self.thread = real_threading.Thread(target=self.run, name='log-writer', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            self.handler.handle(record)
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+
+
+def parse_sample_rates(spec):
+    rates = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        event, _, rate = entry.partition('=')
+        rates[event] = float(rate)
+    return rates
+
+
+def setup_logging(name):
+    logger = logging.getLogger(name)
+    logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+    logger.propagate = False
+    logger.addFilter(SampleFilter(parse_sample_rates(
+        os.environ.get('LOG_SAMPLE_RATES', DEFAULT_SAMPLE_RATES))))
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter() if os.environ.get('LOG_FORMAT') == 'text' else JSONFormatter())
+
+    queue = real_queue.Queue(QUEUE_SIZE)
+    logger.addHandler(QueueingHandler(queue))
+    writer = LogWriter(queue, output)
+    writer.start()
+    # Registered first, so it runs last and catches shutdown messages
+    atexit.register(writer.stop)
+    return logger
@@ -0,0 +1,127 @@
+"""Two worker processes sharing one game.
+
+Starts two real server processes that share a SQLite room store and a
+SQLite play database, with Socket.IO emits between them going through a
+small zmq broker run by the test. The host bot connects to one worker
+and the guest bot to the other, and they play a full 6-round game, so
+every room event is handled by whichever worker the sender is on.
+
+Needs pyzmq and the Socket.IO client: pip install pyzmq "python-socketio[client]"
+"""
+import argparse
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import pytest
+
+zmq = pytest.importorskip('zmq')
+pytest.importorskip('websocket')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import loadtest  # noqa: E402
+
+WORKER = """
+import sys
+import app
+from migrations import migrate
+with app.app.app_context():
+    migrate(app.db.engine)
+app.socketio.run(app.app, host='127.0.0.1', port=int(sys.argv[1]), log_output=False)
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run_broker(context, sink_port, publish_port):
+    # The broker python-socketio's ZmqManager expects: every message
+    # pushed by any worker is published to all of them
+    receiver = context.socket(zmq.PULL)
+    receiver.bind(f"tcp://127.0.0.1:{sink_port}")
+    publisher = context.socket(zmq.PUB)
+    publisher.bind(f"tcp://127.0.0.1:{publish_port}")
+    try:
+        zmq.proxy(receiver, publisher)
+    except zmq.ContextTerminated:
+        pass
+    finally:
+        receiver.close(linger=0)
+        publisher.close(linger=0)
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url + '/metrics', timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+@pytest.fixture
+def workers(tmp_path):
+    context = zmq.Context()
+    sink_port, publish_port = free_port(), free_port()
+    threading.Thread(target=run_broker, args=(context, sink_port, publish_port),
+                     daemon=True).start()
+
+    env = dict(os.environ,
+               DATABASE_URL=f"sqlite:///{tmp_path / 'plays.db'}",
+               ROOM_STORE_URL=f"sqlite:///{tmp_path / 'rooms.db'}",
+               SOCKETIO_MESSAGE_QUEUE=f"zmq+tcp://127.0.0.1:{sink_port}+{publish_port}",
+               LOG_LEVEL='warning')
+    processes, urls = [], []
+    try:
+        # One at a time, so only the first one creates the schema
+        for _ in range(2):
+            port = free_port()
+            processes.append(subprocess.Popen([sys.executable, '-c', WORKER, str(port)],
+                                              cwd=ROOT, env=env))
+            urls.append(f"http://127.0.0.1:{port}")
+            wait_until_up(urls[-1])
+        yield urls, tmp_path / 'plays.db'
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+        context.term()
+
+
+def saved_plays(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*), SUM(game_complete) FROM play").fetchone()
+    finally:
+        conn.close()
+
+
+def test_full_game_across_two_workers(workers):
+    (host_url, guest_url), plays_db = workers
+    args = argparse.Namespace(url=host_url, guest_url=guest_url, play_delay=0, input_delay=0,
+                              mistake_rate=0.2, timeout=15)
+    stats = loadtest.Stats()
+
+    loadtest.play_game(args, stats)
+
+    assert not stats.errors
+    assert stats.games == 1
+    # Every round is flushed by the worker that handled its last answer
+    deadline = time.monotonic() + 15
+    while saved_plays(plays_db) != (60, 60) and time.monotonic() < deadline:
+        time.sleep(0.2)
+    assert saved_plays(plays_db) == (60, 60)